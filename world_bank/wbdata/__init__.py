@@ -5,8 +5,30 @@ wbdata: A wrapper for the World Bank API
 from __future__ import (print_function, division, absolute_import,
                         unicode_literals)
 
-from .api import (get_country, get_data, get_dataframe, get_panel,
+import sys
+
+from .api import (get_country, get_cube, get_data, get_dataframe, get_panel,
                    get_indicator, get_incomelevel, get_lendingtype, get_source,
                    get_topic, search_countries, search_indicators)
 
+ASYNC_API = ("fetch_async", "get_country_async", "get_data_async",
+             "get_dataframe_async", "get_incomelevel_async",
+             "get_indicator_async", "get_lendingtype_async",
+             "get_source_async", "get_topic_async")
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        # the coroutine API is imported on first use, as asyncio is slow to
+        # import
+        if name in ASYNC_API:
+            from . import aio
+            return getattr(aio, name)
+        raise AttributeError("module {0!r} has no attribute {1!r}".format(
+            __name__, name))
+elif sys.version_info >= (3, 5):
+    from .aio import (fetch_async, get_country_async, get_data_async,
+                      get_dataframe_async, get_incomelevel_async,
+                      get_indicator_async, get_lendingtype_async,
+                      get_source_async, get_topic_async)
+
 __version__ = "0.2.7"
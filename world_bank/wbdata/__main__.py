@@ -0,0 +1,33 @@
+"""
+Usage: python -m wbdata <command> [<args>]
+
+Commands:
+    prefetch    warm the cache for the queries in a manifest
+"""
+
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+import sys
+
+from . import prefetch
+
+COMMANDS = {"prefetch": prefetch.main}
+
+
+def main(argv=None):
+    """
+    Run a wbdata command from the command line
+
+    :argv: command line arguments, not including the program name
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    if not argv or argv[0] not in COMMANDS:
+        print(__doc__, file=sys.stderr)
+        return 2
+    return COMMANDS[argv[0]](argv[1:])
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,237 @@
+"""
+wbdata.aio: coroutine counterparts of the wbdata API
+
+These share the cache and url building of the blocking functions.  The
+standard library has no asynchronous HTTP client, so each page is fetched
+by fetcher.fetch_page in the event loop's default executor, over the same
+pooled connections; at most CONCURRENCY pages are in flight per event loop.
+"""
+
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+import asyncio
+import weakref
+
+from . import api, fetcher
+
+CONCURRENCY = 8
+
+_SEMAPHORES = weakref.WeakKeyDictionary()
+
+
+def get_semaphore():
+    """
+    Return the semaphore limiting concurrent page fetches on the running
+    event loop, creating it with CONCURRENCY slots if need be
+    """
+    loop = asyncio.get_event_loop()
+    try:
+        return _SEMAPHORES[loop]
+    except KeyError:
+        semaphore = _SEMAPHORES[loop] = asyncio.Semaphore(CONCURRENCY)
+        return semaphore
+
+
+async def fetch_page_async(page_url, cached=True):
+    """
+    Fetch and decode a single page of a query, as fetcher.fetch_page
+
+    :page_url: the full url of the page
+    :cached: use the cache
+    :returns: the decoded response, or None if there was no usable response
+    """
+    loop = asyncio.get_event_loop()
+    async with get_semaphore():
+        return await loop.run_in_executor(None, fetcher.fetch_page, page_url,
+                                          cached)
+
+
+async def fetch_async(query_url, args=None, cached=True):
+    """
+    Fetch data from the World Bank API or from cache, as fetcher.fetch,
+    splitting queries for many countries and answering queries for some
+    years of indicator data from cached wider ones in the same way
+
+    :query_url: the base url to be queried
+    :args: a dictionary of GET arguments
+    :cached: use the cache
+    :returns: a list of dictionaries containing the response to the query,
+        or None if there is no data or any part of it couldn't be fetched
+    """
+    chunks = fetcher.split_countries(query_url)
+    if len(chunks) > 1:
+        parts = await asyncio.gather(*[fetch_query_async(url, args, cached)
+                                       for url in chunks])
+        results = fetcher.join_parts(parts)
+    else:
+        results = await fetch_query_async(query_url, args, cached)
+    return results or None
+
+
+async def fetch_query_async(query_url, args=None, cached=True):
+    """
+    Fetch a query naming at most fetcher.COUNTRY_CHUNK countries, as
+    fetcher.fetch_query
+
+    :query_url: the base url to be queried
+    :args: a dictionary of GET arguments
+    :cached: use the cache
+    :returns: a list of dictionaries, empty if the API has no data for the
+        query, or None if any page couldn't be fetched
+    """
+    loop = asyncio.get_event_loop()
+    results = await loop.run_in_executor(None, fetcher.fetch_range,
+                                         query_url, args, cached)
+    if results is not None:
+        return results
+    page_url = fetcher.build_url(query_url, args)
+    response = await fetch_page_async(page_url, cached)
+    if response is None:
+        return None
+    page_urls = fetcher.remaining_page_urls(page_url, response)
+    responses = await asyncio.gather(*[fetch_page_async(url, cached)
+                                       for url in page_urls])
+    results = fetcher.collect_results([response] + list(responses))
+    await loop.run_in_executor(None, fetcher.cover_query, query_url, args,
+                               results)
+    return results
+
+
+async def get_data_async(indicator, country="all", data_date=None,
+                         convert_date=False, pandas=False, column_name="value",
+                         keep_levels=False, mrv=None, gapfill=False):
+    """
+    Retrieve indicators for given countries and years, as api.get_data
+
+    :indicator: the desired indicator code
+    :country: a country code, sequence of country codes, or "all" (default)
+    :data_date: the desired date as a datetime object or a 2-tuple with
+        start and end dates
+    :convert_date: if True, convert date field to a datetime.datetime object.
+    :pandas: if True, return results as a pandas Series
+    :column_name: the desired name for the pandas column
+    :keep_levels: if True and pandas is True, don't reduce the number of
+        index levels returned if only getting one date or country
+    :mrv: if given, retrieve only this many of the most recent values for
+        each country instead of a date
+    :gapfill: if True, fill values missing from the most recent ones with
+        the latest earlier value.  Requires mrv
+    :returns: list of dictionaries or pandas Series
+    """
+    query_url, args = api.data_query(indicator, country, data_date, mrv,
+                                     gapfill)
+    data = await fetch_async(query_url, args)
+    return api.format_data(data, convert_date, pandas, column_name,
+                           keep_levels, mrv)
+
+
+@api.uses_pandas
+async def get_dataframe_async(indicators, country="all", data_date=None,
+                              convert_date=False, keep_levels=False,
+                              mrv=None, gapfill=False):
+    """
+    Download a set of indicators concurrently and merge them into a pandas
+    DataFrame, as api.get_dataframe
+
+    :indicators: An dictionary where the keys are desired indicators and the
+        values are the desired column names
+    :country: a country code, sequence of country codes, or "all" (default)
+    :data_date: the desired date as a datetime object or a 2-sequence with
+        start and end dates
+    :convert_date: if True, convert date field to a datetime.datetime object.
+    :keep_levels: if True and pandas is True, don't reduce the number of
+        index levels returned if only getting one date or country
+    :mrv: if given, retrieve only this many of the most recent values for
+        each country instead of a date
+    :gapfill: if True, fill values missing from the most recent ones with
+        the latest earlier value.  Requires mrv
+    :returns: a pandas dataframe
+    """
+    names = list(indicators)
+    series = await asyncio.gather(*[
+        get_data_async(i, country, data_date, convert_date, pandas=True,
+                       keep_levels=keep_levels, mrv=mrv, gapfill=gapfill)
+        for i in names])
+    return api.combine_series({indicators[i]: s
+                               for i, s in zip(names, series)})
+
+
+async def get_source_async(source_id=None):
+    """
+    Retrieve information on a source, as api.get_source
+
+    :source_id: a source id or sequence thereof.  None returns all sources
+    :returns: a list of dictionaries describing sources
+    """
+    return await fetch_async(api.id_query_url(api.SOURCES_URL, source_id))
+
+
+async def get_incomelevel_async(level_id=None):
+    """
+    Retrieve information on an income level aggregate, as
+    api.get_incomelevel
+
+    :level_id: a level id or sequence thereof.  None returns all income level
+        aggregates
+    :returns: a list of dictionaries describing income level aggregates
+    """
+    return await fetch_async(api.id_query_url(api.ILEVEL_URL, level_id))
+
+
+async def get_topic_async(topic_id=None):
+    """
+    Retrieve information on a topic, as api.get_topic
+
+    :topic_id: a topic id or sequence thereof.  None returns all topics
+    :returns: a list of dictionaries describing topics
+    """
+    return await fetch_async(api.id_query_url(api.TOPIC_URL, topic_id))
+
+
+async def get_lendingtype_async(type_id=None):
+    """
+    Retrieve information on a lending type aggregate, as api.get_lendingtype
+
+    :type_id: lending type id or sequence thereof.  None returns all lending
+        type aggregates
+    :returns: a list of dictionaries describing lending type aggregates
+    """
+    return await fetch_async(api.id_query_url(api.LTYPE_URL, type_id))
+
+
+async def get_country_async(country_id=None, incomelevel=None,
+                            lendingtype=None):
+    """
+    Retrieve information on a country or regional aggregate, as
+    api.get_country.  Can specify either country_id, or the aggregates, but
+    not both
+
+    :country_id: a country id or sequence thereof. None returns all countries
+        and aggregates.
+    :incomelevel: desired incomelevel id or ids.
+    :lendingtype: desired lendingtype id or ids.
+    :returns: a list of dictionaries describing countries
+    """
+    if country_id:
+        if incomelevel or lendingtype:
+            raise ValueError("Can't specify country_id and aggregates")
+        return await fetch_async(api.id_query_url(api.COUNTRIES_URL,
+                                                  country_id))
+    return await fetch_async(api.COUNTRIES_URL,
+                             api.country_args(incomelevel, lendingtype))
+
+
+async def get_indicator_async(indicator=None, source=None, topic=None):
+    """
+    Retrieve information about an indicator or indicators, as
+    api.get_indicator.  Only one of indicator, source, and topic can be
+    specified.
+
+    :indicator: an indicator code or sequence thereof
+    :source: a source id or sequence thereof
+    :topic: a topic id or sequence thereof
+    :returns: a list of dictionaries representing indicators
+    """
+    return await fetch_async(api.indicator_query_url(indicator, source,
+                                                     topic))
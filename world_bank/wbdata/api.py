@@ -7,13 +7,9 @@ from __future__ import (print_function, division, absolute_import,
 
 import datetime
 
-try:
-    import pandas as pd
-except ImportError:
-    pd = None
-
 from decorator import decorator
 from . import fetcher
+from .hooks import timed
 
 # Detect Interactivity
 import __main__ as main
@@ -28,12 +24,35 @@ LTYPE_URL = "{0}/lendingTypes".format(BASE_URL)
 SOURCES_URL = "{0}/sources".format(BASE_URL)
 TOPIC_URL = "{0}/topics".format(BASE_URL)
 INDIC_ERROR = "Cannot specify more than one of indicator, source, and topic"
+INDICATOR_BATCH = 20
+
+# pandas is slow to import, so it is only imported by the first function
+# that needs it, along with numpy, which it requires; see load_pandas
+pd = None
+np = None
+
+
+def load_pandas():
+    """
+    Import pandas and numpy if that hasn't been tried yet
+
+    :returns: the pandas module, or None if it is not installed
+    """
+    global pd, np
+    if pd is None:
+        try:
+            import numpy
+            import pandas
+            np, pd = numpy, pandas
+        except ImportError:
+            pd = False
+    return pd or None
 
 
 @decorator
 def uses_pandas(f, *args, **kwargs):
-    """Raise ValueError if pandas is not loaded"""
-    if not pd:
+    """Raise ValueError if pandas is not installed"""
+    if not load_pandas():
         raise ValueError("Pandas must be installed to be used")
     return f(*args, **kwargs)
 
@@ -72,28 +91,59 @@ def convert_quarter_to_datetime(quarterstr):
     return datetime.datetime(int(split[0]), month, 1)
 
 
+def convert_date_to_datetime(datestr):
+    """
+    Return a datetime.datetime object from a date string as provided by the
+    World Bank, or the string itself if it is a most recent value or a range
+    """
+    if "MRV" in datestr or "-" in datestr:
+        return datestr
+    if "M" in datestr:
+        return convert_month_to_datetime(datestr)
+    if "Q" in datestr:
+        return convert_quarter_to_datetime(datestr)
+    return convert_year_to_datetime(datestr)
+
+
 def convert_dates_to_datetime(data):
     """
     Return a datetime.datetime object from a date string as provided by the
     World Bank
     """
-    first = data[0]['date']
-    if "M" in first:
-        converter = convert_month_to_datetime
-    elif "Q" in first:
-        converter = convert_quarter_to_datetime
-    else:
-        converter = convert_year_to_datetime
+    # a query has few distinct dates, so each is converted only once
+    converted = {}
     for datum in data:
         datum_date = datum['date']
-        if "MRV" in datum_date:
-            continue
-        if "-" in datum_date:
-            continue
-        datum['date'] = converter(datum_date)
+        try:
+            datum['date'] = converted[datum_date]
+        except KeyError:
+            datum['date'] = converted[datum_date] = convert_date_to_datetime(
+                datum_date)
     return data
 
 
+@uses_pandas
+def convert_date_column(dates):
+    """
+    Convert a Series of date strings as provided by the World Bank, parsing
+    each distinct date once.  The result has dtype datetime64, unless some
+    dates are most recent values or ranges, which are left as strings.
+
+    :dates: a pandas Series of date strings
+    :returns: a pandas Series with the same index
+    """
+    codes, uniques = pd.factorize(dates)
+    converted = [convert_date_to_datetime(i) for i in uniques]
+    dated = all(isinstance(i, datetime.datetime) for i in converted)
+    # a missing date has code -1, which takes the last value
+    converted.append(None)
+    if dated:
+        values = pd.DatetimeIndex(converted)
+    else:
+        values = pd.Index(converted, dtype=object)
+    return pd.Series(values.take(codes), index=dates.index, name=dates.name)
+
+
 def cast_float(value):
     """
     Return a floated value or none
@@ -109,33 +159,50 @@ def cast_float(value):
 @uses_pandas
 def convert_to_dataframe(data, column_name):
     """
-    Convert a set of values to a dataframe with columns for country and date
-    """
-    return pd.DataFrame({"country": [i["country"]["value"] for i in data],
+    Convert a set of values to a dataframe with columns for country and date.
+    Countries are categorical, with their categories sorted so that they
+    sort as the names do, and values are float64, with NaN where there is
+    no number.
+    """
+    seen = {}
+    codes = [seen.setdefault(i["country"]["value"], len(seen)) for i in data]
+    categories = sorted(seen)
+    # recode from the order countries were first seen to sorted order
+    rank = np.empty(len(categories), dtype="int64")
+    rank[[seen[i] for i in categories]] = np.arange(len(categories))
+    codes = rank[np.asarray(codes, dtype="int64")]
+    values = [i["value"] for i in data]
+    try:
+        # None becomes NaN, and numeric strings are parsed, all at once
+        values = np.array(values, dtype="float64")
+    except (TypeError, ValueError):
+        values = pd.to_numeric(pd.Series(values, dtype=object),
+                               errors="coerce").to_numpy(dtype="float64")
+    return pd.DataFrame({"country": pd.Categorical.from_codes(
+                             codes, categories=categories),
                          "date": [i["date"] for i in data],
-                         column_name: [cast_float(i["value"]) for i in data]
-                         })
+                         column_name: values})
 
 
-def get_data(indicator, country="all", data_date=None, convert_date=False,
-             pandas=False, column_name="value", keep_levels=False):
+def data_query(indicator, country="all", data_date=None, mrv=None,
+               gapfill=False):
     """
-    Retrieve indicators for given countries and years
+    Return the url and GET arguments for retrieving an indicator
 
     :indicator: the desired indicator code
     :country: a country code, sequence of country codes, or "all" (default)
-    :date: the desired date as a datetime object or a 2-tuple with
+    :data_date: the desired date as a datetime object or a 2-tuple with
         start and end dates
-    :convert_date: if True, convert date field to a datetime.datetime object.
-    :pandas: if True, return results as a pandas Series.  The index will be the
-        date of the data if only one country is specified, the countries if
-        only one date is specified, or a multi-index of country and date
-        otherwise.
-    :column_name: the desired name for the pandas column
-    :keep_levels: if True and pandas is True, don't reduce the number of
-        index levels returned if only getting one date or country
-    :returns: list of dictionaries or pandas Series
-    """
+    :mrv: if given, retrieve only this many of the most recent values for
+        each country instead of a date
+    :gapfill: if True, fill values missing from the most recent ones with
+        the latest earlier value.  Requires mrv
+    :returns: a (query_url, args) tuple to pass to fetcher.fetch
+    """
+    if mrv and data_date:
+        raise ValueError("Cannot specify both data_date and mrv")
+    if gapfill and not mrv:
+        raise ValueError("gapfill requires mrv")
     query_url = COUNTRIES_URL
     try:
         c_part = parse_value_or_iterable(country)
@@ -149,23 +216,143 @@ def get_data(indicator, country="all", data_date=None, convert_date=False,
             args.append(("date", data_date_str))
         else:
             args.append(("date", data_date.strftime("%Y")))
-    data = fetcher.fetch(query_url, args)
+    if mrv:
+        args.append(("mrv", int(mrv)))
+    if gapfill:
+        args.append(("gapfill", "Y"))
+    return query_url, args
+
+
+def format_data(data, convert_date=False, pandas=False, column_name="value",
+                keep_levels=False, mrv=None):
+    """
+    Convert fetched indicator data into the form get_data returns
+
+    :data: a list of dictionaries as returned by fetcher.fetch, or None
+    :convert_date: if True, convert date field to a datetime.datetime object.
+    :pandas: if True, return results as a pandas Series, indexed as
+        described in get_data
+    :column_name: the desired name for the pandas column
+    :keep_levels: if True and pandas is True, don't reduce the number of
+        index levels returned if only getting one date or country
+    :mrv: the number of most recent values queried, if any.  A Series of
+        the single most recent value is indexed by country
+    :returns: list of dictionaries or pandas Series
+    """
     if data is None:
         return data
-    if convert_date:
-        data = convert_dates_to_datetime(data)
     if pandas:
-        df = convert_to_dataframe(data, column_name)
-        if not keep_levels and len(df["country"].unique()) == 1:
-            df = df.set_index("date")
-        elif not keep_levels and len(df["date"].unique()) == 1:
-            df = df.set_index("country")
-        else:
-            df = df.set_index(["country", "date"])
-        return df[column_name]
+        df = timed("convert_to_dataframe", convert_to_dataframe, data,
+                   column_name)
+        if convert_date:
+            df["date"] = timed("convert_dates", convert_date_column,
+                               df["date"])
+        return timed("set_index", index_series, df, column_name, keep_levels,
+                     mrv == 1)
+    if convert_date:
+        data = timed("convert_dates", convert_dates_to_datetime, data)
     return data
 
 
+def index_series(df, column_name, keep_levels=False, by_country=False):
+    """
+    Return a column of a DataFrame made by convert_to_dataframe as a Series
+    indexed by date if there is only one country, by country if there is
+    only one date, or by both otherwise
+
+    :df: the DataFrame
+    :column_name: the column to return
+    :keep_levels: if True, always index by both country and date
+    :by_country: if True and keep_levels is False, index by country, as
+        there is one value per country though their dates may differ
+    """
+    if not keep_levels and by_country:
+        df = df.set_index("country")
+    elif not keep_levels and df["country"].nunique() == 1:
+        df = df.set_index("date")
+    elif not keep_levels and df["date"].nunique() == 1:
+        df = df.set_index("country")
+    else:
+        df = df.set_index(["country", "date"])
+    return df[column_name]
+
+
+def get_data(indicator, country="all", data_date=None, convert_date=False,
+             pandas=False, column_name="value", keep_levels=False,
+             stream=False, incremental=False, mrv=None, gapfill=False):
+    """
+    Retrieve indicators for given countries and years
+
+    :indicator: the desired indicator code
+    :country: a country code, sequence of country codes, or "all" (default)
+    :date: the desired date as a datetime object or a 2-tuple with
+        start and end dates
+    :convert_date: if True, convert date field to a datetime.datetime object.
+    :pandas: if True, return results as a pandas Series.  The index will be the
+        date of the data if only one country is specified, the countries if
+        only one date is specified, or a multi-index of country and date
+        otherwise.
+    :column_name: the desired name for the pandas column
+    :keep_levels: if True and pandas is True, don't reduce the number of
+        index levels returned if only getting one date or country
+    :stream: if True, return a generator yielding the results one page at a
+        time instead, so that large queries can be processed with bounded
+        memory.  Each page is a list of dictionaries, or a pandas Series if
+        pandas is True; Series always keep both index levels so that pages
+        line up.
+    :incremental: if True, keep every year of the indicator for these
+        countries in the cache and, once it expires, fetch only the latest
+        years again and merge them in, as fetcher.fetch_incremental does.
+        Cannot be combined with stream or mrv.
+    :mrv: if given, retrieve only this many of the most recent values for
+        each country instead of a date.  With mrv=1 and pandas, the Series
+        is indexed by country unless keep_levels is True.
+    :gapfill: if True, fill values missing from the most recent ones with
+        the latest earlier value.  Requires mrv
+    :returns: list of dictionaries or pandas Series
+    """
+    if stream and incremental:
+        raise ValueError("Cannot stream an incremental fetch")
+    query_url, args = timed("build_url", data_query, indicator, country,
+                            data_date, mrv, gapfill)
+    if incremental:
+        data = timed("fetch", fetcher.fetch_incremental, query_url, args)
+        return format_data(data, convert_date, pandas, column_name,
+                           keep_levels, mrv)
+    if stream:
+        return (format_data(page, convert_date, pandas, column_name,
+                            keep_levels=True)
+                for page in fetcher.iter_fetch(query_url, args))
+    data = timed("fetch", fetcher.fetch, query_url, args)
+    return format_data(data, convert_date, pandas, column_name, keep_levels,
+                       mrv)
+
+
+def get_refresh_info(indicator, country="all"):
+    """
+    Retrieve when an indicator fetched with incremental=True was last
+    refreshed, and what changed, as described in fetcher.refresh_info
+
+    :indicator: the indicator code
+    :country: a country code, sequence of country codes, or "all" (default)
+    :returns: a dictionary, or None if the indicator hasn't been fetched
+        incrementally for these countries
+    """
+    return fetcher.refresh_info(data_query(indicator, country)[0])
+
+
+def id_query_url(query_url, query_id):
+    """
+    Return the url for retrieving information by id
+
+    :query_url: the base url to use for the query
+    :query_id: an id or sequence thereof.  None returns all
+    """
+    if query_id:
+        query_url = "/".join((query_url, parse_value_or_iterable(query_id)))
+    return query_url
+
+
 def id_only_query(query_url, query_id, display):
     """
     Retrieve information when ids are the only arguments
@@ -178,9 +365,7 @@ def id_only_query(query_url, query_id, display):
     """
     if display is None:
         display = INTERACTIVE
-    if query_id:
-        query_url = "/".join((query_url, parse_value_or_iterable(query_id)))
-    results = fetcher.fetch(query_url)
+    results = fetcher.fetch(id_query_url(query_url, query_id))
     if display:
         print_ids_and_names(results)
     else:
@@ -240,6 +425,21 @@ def get_lendingtype(type_id=None, display=None):
     return id_only_query(LTYPE_URL, type_id, display)
 
 
+def country_args(incomelevel=None, lendingtype=None):
+    """
+    Return the GET arguments for retrieving countries by aggregate
+
+    :incomelevel: desired incomelevel id or ids.
+    :lendingtype: desired lendingtype id or ids.
+    """
+    args = []
+    if incomelevel:
+        args.append(("incomeLevel", parse_value_or_iterable(incomelevel)))
+    if lendingtype:
+        args.append(("lendingType", parse_value_or_iterable(lendingtype)))
+    return args
+
+
 def get_country(country_id=None, incomelevel=None, lendingtype=None,
                 display=None):
     """
@@ -261,18 +461,38 @@ def get_country(country_id=None, incomelevel=None, lendingtype=None,
         if incomelevel or lendingtype:
             raise ValueError("Can't specify country_id and aggregates")
         return id_only_query(COUNTRIES_URL, country_id, display)
-    args = []
-    if incomelevel:
-        args.append(("incomeLevel", parse_value_or_iterable(incomelevel)))
-    if lendingtype:
-        args.append(("lendingType", parse_value_or_iterable(lendingtype)))
-    results = fetcher.fetch(COUNTRIES_URL, args)
+    results = fetcher.fetch(COUNTRIES_URL,
+                            country_args(incomelevel, lendingtype))
     if display:
         print_ids_and_names(results)
     else:
         return results
 
 
+def indicator_query_url(indicator=None, source=None, topic=None):
+    """
+    Return the url for retrieving information about indicators.  Only one of
+    indicator, source, and topic can be specified.
+
+    :indicator: an indicator code or sequence thereof
+    :source: a source id or sequence thereof
+    :topic: a topic id or sequence thereof
+    """
+    if indicator:
+        if source or topic:
+            raise ValueError(INDIC_ERROR)
+        return "/".join((INDICATOR_URL, parse_value_or_iterable(indicator)))
+    if source:
+        if topic:
+            raise ValueError(INDIC_ERROR)
+        return "/".join((SOURCES_URL, parse_value_or_iterable(source),
+                         "indicators"))
+    if topic:
+        return "/".join((TOPIC_URL, parse_value_or_iterable(topic),
+                         "indicators"))
+    return INDICATOR_URL
+
+
 def get_indicator(indicator=None, source=None, topic=None, display=None):
     """
     Retrieve information about an indicator or indicators.  Only one of
@@ -289,22 +509,7 @@ def get_indicator(indicator=None, source=None, topic=None, display=None):
     """
     if display is None:
         display = INTERACTIVE
-    if indicator:
-        if source or topic:
-            raise ValueError(INDIC_ERROR)
-        query_url = "/".join((INDICATOR_URL,
-                              parse_value_or_iterable(indicator)))
-    elif source:
-        if topic:
-            raise ValueError(INDIC_ERROR)
-        query_url = "/".join((SOURCES_URL, parse_value_or_iterable(source),
-                              "indicators"))
-    elif topic:
-        query_url = "/".join((TOPIC_URL, parse_value_or_iterable(topic),
-                              "indicators"))
-    else:
-        query_url = INDICATOR_URL
-    results = fetcher.fetch(query_url)
+    results = fetcher.fetch(indicator_query_url(indicator, source, topic))
     if display:
         print_ids_and_names(results)
     else:
@@ -380,9 +585,69 @@ def print_ids_and_names(objs):
             print(templ.format(**i))
 
 
+def indicator_batches(indicators, size=None):
+    """
+    Group indicators that share a source into batches that can each be
+    retrieved with one query
+
+    :indicators: a sequence of indicator codes
+    :size: the most indicators in a batch.  Defaults to INDICATOR_BATCH
+    :returns: a list of (source, codes) tuples, one for each batch of two or
+        more indicators.  Indicators whose source isn't known are left out.
+    """
+    if size is None:
+        size = INDICATOR_BATCH
+    found = fetcher.fetch(indicator_query_url(list(indicators))) or []
+    sources = dict((i["id"].lower(), i["source"]["id"]) for i in found
+                   if i.get("source"))
+    groups = {}
+    for code in indicators:
+        source = sources.get(code.lower())
+        if source is not None:
+            groups.setdefault(source, []).append(code)
+    batches = []
+    for source in sorted(groups):
+        codes = groups[source]
+        for start in range(0, len(codes), size):
+            if len(codes[start:start + size]) > 1:
+                batches.append((source, codes[start:start + size]))
+    return batches
+
+
+def get_batch(indicators, source, country="all", data_date=None, mrv=None,
+              gapfill=False):
+    """
+    Retrieve several indicators from the same source with one query
+
+    :indicators: a sequence of indicator codes
+    :source: the id of the source of every indicator
+    :country: a country code, sequence of country codes, or "all" (default)
+    :data_date: the desired date as a datetime object or a 2-tuple with
+        start and end dates
+    :mrv: if given, retrieve only this many of the most recent values for
+        each country instead of a date
+    :gapfill: if True, fill values missing from the most recent ones with
+        the latest earlier value.  Requires mrv
+    :returns: a dictionary of indicator codes to lists of dictionaries.
+        Indicators the query returned nothing for are left out.
+    """
+    query_url, args = data_query(";".join(indicators), country, data_date,
+                                 mrv, gapfill)
+    args.append(("source", source))
+    data = timed("fetch", fetcher.fetch, query_url, args) or []
+    codes = dict((code.lower(), code) for code in indicators)
+    results = {}
+    for record in data:
+        code = codes.get(record["indicator"]["id"].lower())
+        if code is not None:
+            results.setdefault(code, []).append(record)
+    return results
+
+
 @uses_pandas
 def get_dataframe(indicators, country="all", data_date=None,
-                  convert_date=False, keep_levels=False):
+                  convert_date=False, keep_levels=False, incremental=False,
+                  mrv=None, gapfill=False, workers=None, batch=False):
     """
     Convenience function to download a set of indicators and  merge them into a
         pandas DataFrame.  The index will be the same as if calls were made to
@@ -396,15 +661,227 @@ def get_dataframe(indicators, country="all", data_date=None,
     :convert_date: if True, convert date field to a datetime.datetime object.
     :keep_levels: if True and pandas is True, don't reduce the number of
         index levels returned if only getting one date or country
+    :incremental: if True, bring each indicator up to date incrementally,
+        as described in get_data
+    :mrv: if given, retrieve only this many of the most recent values for
+        each country instead of a date
+    :gapfill: if True, fill values missing from the most recent ones with
+        the latest earlier value.  Requires mrv
+    :workers: the most indicators or batches to retrieve at once.  Defaults
+        to fetcher.THREADS
+    :batch: if True, retrieve indicators from the same source together, up
+        to INDICATOR_BATCH in one query.  Ignored if incremental is True.
     :returns: a pandas dataframe
     """
-    to_df = {indicators[i]: get_data(i, country, data_date, convert_date,
-                                     pandas=True, keep_levels=keep_levels)
-             for i in indicators}
-    for k,v in to_df.items(): 
+    if workers is None:
+        workers = fetcher.THREADS
+    names = list(indicators)
+    batches = []
+    if batch and not incremental:
+        batches = indicator_batches(names)
+    batched = set(code for source, codes in batches for code in codes)
+    tasks = batches + [(None, [i]) for i in names if i not in batched]
+
+    def retrieve(task):
+        source, codes = task
+        data = {}
+        if source is not None:
+            data = get_batch(codes, source, country, data_date, mrv, gapfill)
+        series = {}
+        for code in codes:
+            if code in data:
+                series[code] = format_data(data[code], convert_date, True,
+                                           keep_levels=keep_levels, mrv=mrv)
+            else:
+                # not batched, or missing from the batch: query it alone
+                series[code] = get_data(code, country, data_date,
+                                        convert_date, pandas=True,
+                                        keep_levels=keep_levels,
+                                        incremental=incremental, mrv=mrv,
+                                        gapfill=gapfill)
+        return series
+
+    pool = fetcher.thread_pool(max(1, min(workers, len(tasks))))
+    try:
+        results = {}
+        for series in pool.map(retrieve, tasks):
+            results.update(series)
+    finally:
+        pool.close()
+    to_df = {indicators[i]: results[i] for i in names}
+    return combine_series(to_df)
+
+
+def same_levels(a, b):
+    """Return whether two pandas MultiIndexes have the same levels"""
+    return (a.nlevels == b.nlevels and
+            all(np.array_equal(np.asarray(x), np.asarray(y))
+                for x, y in zip(a.levels, b.levels)))
+
+
+def same_index(a, b):
+    """
+    Return whether two pandas indexes hold the same labels in the same
+    order.  MultiIndexes are compared by their levels and codes, which is
+    much quicker than comparing their labels.
+    """
+    if a is b:
+        return True
+    if isinstance(a, pd.MultiIndex) and isinstance(b, pd.MultiIndex):
+        return (len(a) == len(b) and same_levels(a, b) and
+                all(np.array_equal(x, y) for x, y in zip(a.codes, b.codes)))
+    return a.equals(b)
+
+
+def merge_levels(indexes):
+    """
+    Return the sorted union of each level of pandas MultiIndexes, and how
+    to map the codes of each index to those levels.  A level that is
+    categorical in every index, as countries are, stays categorical, with
+    every index's categories.
+
+    :indexes: a list of pandas MultiIndexes with the same number of levels
+    :returns: a (levels, mappings) tuple, where mappings holds, for each of
+        indexes, an array per level giving the position in the merged level
+        of each of its codes; or None if a level can't be sorted
+    """
+    first = indexes[0]
+    if all(same_levels(i, first) for i in indexes[1:]):
+        orders = [level.argsort() for level in first.levels]
+        ranks = []
+        for order in orders:
+            rank = np.empty(len(order), dtype="int64")
+            rank[order] = np.arange(len(order))
+            ranks.append(rank)
+        return ([level.take(order) for level, order in
+                 zip(first.levels, orders)], [ranks] * len(indexes))
+    levels = []
+    mappings = [[] for i in indexes]
+    for position in range(first.nlevels):
+        parts = [i.levels[position] for i in indexes]
+        try:
+            level = parts[0].append(parts[1:]).unique().sort_values()
+        except TypeError:
+            return None
+        if all(isinstance(i, pd.CategoricalIndex) for i in parts):
+            labels = list(level)
+            level = pd.CategoricalIndex(labels, categories=labels)
+        levels.append(level)
+        for mapping, part in zip(mappings, parts):
+            mapping.append(level.get_indexer(part))
+    return levels, mappings
+
+
+def union_index(indexes):
+    """
+    Return the sorted union of pandas indexes, and where the labels of each
+    index fall in it
+
+    MultiIndexes, as those of Series from get_data are, are merged through
+    their codes: their levels are merged, and each combination of levels is
+    marked in a table, which the union is read off in order, without
+    building or hashing the labels of every index.
+
+    :indexes: a list of pandas indexes, each without duplicates
+    :returns: an (index, positions) tuple, where positions holds an array
+        of positions in index for each of indexes
+    """
+    first = indexes[0]
+    merged = None
+    if isinstance(first, pd.MultiIndex) and all(
+            isinstance(i, pd.MultiIndex) and i.nlevels == first.nlevels and
+            all((codes >= 0).all() for codes in i.codes) for i in indexes):
+        merged = merge_levels(indexes)
+    if merged is not None:
+        levels, mappings = merged
+        shape = tuple(len(level) for level in levels)
+        cells = 1
+        for size in shape:
+            cells *= size
+        if cells <= 1 << 22:
+            keys = [np.ravel_multi_index([mapping[codes] for mapping, codes in
+                                          zip(i_mappings, i.codes)], shape)
+                    for i_mappings, i in zip(mappings, indexes)]
+            present = np.zeros(cells, dtype=bool)
+            for key in keys:
+                present[key] = True
+            union = np.flatnonzero(present)
+            lookup = np.full(cells, -1, dtype="int64")
+            lookup[union] = np.arange(len(union))
+            index = pd.MultiIndex(
+                levels=levels, codes=np.unravel_index(union, shape),
+                names=first.names, verify_integrity=False)
+            return index, [lookup[key] for key in keys]
+    index = first.append(indexes[1:]).unique()
+    try:
+        # sorted, as pandas sorts the union of differing indexes
+        index = index.sort_values()
+    except TypeError:
+        pass
+    return index, [index.get_indexer(i) for i in indexes]
+
+
+@uses_pandas
+def combine_series(to_df):
+    """
+    Merge Series returned by get_data into a DataFrame.  The index shared by
+    the Series is built once, as their union if they differ, and each column
+    is filled by position into a single float64 block, rather than having
+    pandas align every Series with the others.
+
+    :to_df: a dictionary of column names to pandas Series
+    :returns: a pandas dataframe, or None if any of the Series is None
+    """
+    for k,v in to_df.items():
         if to_df[k] is None:
             return None
-    return pd.DataFrame(to_df)
+    names = list(to_df)
+    series = [to_df[i] for i in names]
+    if not series:
+        return pd.DataFrame(to_df)
+    index = series[0].index
+    if any(i.index.nlevels != index.nlevels or
+           list(i.index.names) != list(index.names) or
+           i.dtype.kind not in "fiub" for i in series):
+        # unlike Series from get_data; leave them to pandas
+        return pd.DataFrame(to_df)
+    positions = [slice(None)] * len(series)
+    if not all(same_index(i.index, index) for i in series):
+        index, positions = union_index([i.index for i in series])
+    values = np.full((len(index), len(series)), np.nan)
+    for column, i in enumerate(series):
+        values[positions[column], column] = i.to_numpy(dtype="float64")
+    return pd.DataFrame(values, index=index, columns=names, copy=False)
+
+
+@uses_pandas
+def get_cube(indicators, country="all", data_date=None, convert_date=False,
+             path=None, workers=None, batch=False):
+    """
+    Download a set of indicators into a dense indicator x country x date
+    array, a replacement for get_panel.  Cube.transpose and Cube.frames give
+    the orientations get_panel supports.
+
+    :indicators: An dictionary where the keys are desired indicators and the
+        values are the desired column names
+    :country: a country code, sequence of country codes, or "all" (default)
+    :data_date: a 2-sequence with start and end dates
+    :convert_date: if True, convert date field to a datetime.datetime object.
+    :path: if given, a .npy file to write the values to and memory-map,
+        with the labels in path + ".json"; Cube.load opens it again
+    :workers: the most indicators or batches to retrieve at once, as in
+        get_dataframe
+    :batch: if True, retrieve indicators from the same source together, as
+        in get_dataframe
+    :returns: a cube.Cube, or None if any indicator returned no data
+    """
+    # numpy is only needed here, once pandas has been imported
+    from .cube import Cube
+    df = get_dataframe(indicators, country, data_date, convert_date,
+                       keep_levels=True, workers=workers, batch=batch)
+    if df is None:
+        return None
+    return Cube.from_frame(df, path)
 
 
 @uses_pandas
@@ -412,7 +889,8 @@ def get_panel(indicators, country="all", data_date=None, convert_date=False,
               items="indicators", major_axis="dates"):
     """
     Convenience function to download a set of indicators and  merge them into a
-        pandas Panel.
+        pandas Panel.  Panels were removed in pandas 0.25; use get_cube
+        instead.
 
     :indicators: An dictionary where the keys are desired indicators and the
         values are the desired column names
@@ -425,6 +903,11 @@ def get_panel(indicators, country="all", data_date=None, convert_date=False,
         "indicators", "countries", "dates"
     :returns: a pandas panel
     """
+    if not hasattr(pd, "Panel"):
+        raise ValueError("pandas {0} has no Panel; use get_cube instead, "
+                         "whose frames(items, major_axis) method returns "
+                         "the Panel's items as DataFrames".format(
+                             pd.__version__))
     df = get_dataframe(indicators, country, data_date, convert_date,
                        keep_levels=True)
     if items == major_axis:
@@ -0,0 +1,682 @@
+"""
+wbdata.cache: an on-disk store for API responses
+"""
+
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+import contextlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+
+try:  # python 2
+    import cPickle as pickle
+except ImportError:  # python 3
+    import pickle
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+COMPRESSION = "zlib"
+DECODED = True
+MAX_SIZE = 512 * 1024 * 1024
+TOUCH_BATCH = 100
+BUSY_TIMEOUT = 60
+
+CODECS = {
+    "none": (lambda data: data, lambda data: data),
+    "zlib": (zlib.compress, zlib.decompress),
+}
+if lzma is not None:
+    CODECS["lzma"] = (lzma.compress, lzma.decompress)
+
+SCHEMA_VERSION = 6
+
+
+def get_cachedir():
+    """Return the per-user directory wbdata keeps its cache in"""
+    # Inspiration for below from Trent Mick and Sridhar Ratnakumar
+    # <http://pypi.python.org/pypi/appdirs/1.2.0>
+    if sys.platform.startswith("win"):
+        basedir = os.path.join(os.getenv("LOCALAPPDATA", os.getenv(
+            "APPDATA", os.path.expanduser("~"))), "wbdata")
+    elif sys.platform == "darwin":
+        basedir = os.path.expanduser('~/Library/Caches')
+    else:
+        basedir = os.getenv('XDG_CACHE_HOME',
+                            os.path.expanduser('~/.cache'))
+    return os.path.join(basedir, 'wbdata')
+
+
+def encode(response, compression=None, decoded=None):
+    """
+    Serialize a decoded API response for storage
+
+    :response: the decoded response
+    :compression: one of the keys of CODECS.  Defaults to COMPRESSION
+    :decoded: if True, store the response pickled so that reading it back
+        skips JSON parsing; otherwise store it as JSON.  Defaults to DECODED
+    :returns: a (codec, format, data) tuple
+    """
+    if compression is None:
+        compression = COMPRESSION
+    if decoded is None:
+        decoded = DECODED
+    if compression not in CODECS:
+        raise ValueError("Unknown compression {0}".format(compression))
+    if decoded:
+        fmt, data = "pickle", pickle.dumps(response, pickle.HIGHEST_PROTOCOL)
+    else:
+        fmt, data = "json", json.dumps(response).encode("utf-8")
+    return compression, fmt, CODECS[compression][0](data)
+
+
+def decode(codec, fmt, data):
+    """
+    Return the response serialized by encode
+
+    :codec: the compression used
+    :fmt: "pickle" or "json"
+    :data: the stored bytes
+    """
+    if isinstance(data, type("")):
+        data = data.encode("utf-8")
+    data = CODECS[codec][1](bytes(data))
+    if fmt == "pickle":
+        return pickle.loads(data)
+    if not isinstance(data, type("")):
+        data = data.decode("utf-8")
+    return json.loads(data)
+
+
+def checksum(data):
+    """Return the CRC-32 of stored bytes, as an unsigned integer"""
+    if isinstance(data, type("")):
+        data = data.encode("utf-8")
+    return zlib.crc32(bytes(data)) & 0xffffffff
+
+
+def connect(path):
+    """
+    Open a cache database for use by several threads and processes.  The
+    connection is in autocommit mode: transactions are begun explicitly.
+
+    :path: the database file
+    """
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None,
+                           check_same_thread=False)
+    # write-ahead logging lets readers carry on while another process
+    # writes, and a crash mid-write leaves the database intact
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    return conn
+
+
+def is_corruption(err):
+    """
+    Return whether a database error means the file is damaged, rather than
+    busy or otherwise unavailable
+    """
+    return (isinstance(err, sqlite3.DatabaseError) and
+            not isinstance(err, sqlite3.OperationalError))
+
+
+class Cache(object):
+    """
+    A cache of API responses keyed by url.  Entries are (day, response)
+    tuples, where response is the decoded JSON of a page, and live in a
+    SQLite database, so that reading or writing an entry touches only that
+    entry rather than the whole cache.  Responses are stored compressed and,
+    by default, pickled so that reading them back skips JSON parsing.
+
+    Once the stored responses grow past max_size bytes, the least recently
+    used entries are evicted.
+
+    The cache also records which years of indicator data each cached query
+    holds, so that a query for some of those years can be answered from it,
+    and keeps small JSON metadata, such as when a series was refreshed.
+
+    Several processes can share the cache: writes are transactions that
+    take the database's write lock, and a crash mid-write leaves it intact.
+    Each entry carries a checksum; an entry that fails it is discarded on
+    reading, and a damaged database is rebuilt from the entries that can
+    still be read.
+    """
+
+    def __init__(self, path=None, compression=None, decoded=None,
+                 max_size=None):
+        """
+        :path: the database file to use.  Defaults to "cache.sqlite" in the
+            wbdata cache directory
+        :compression: one of the keys of CODECS.  Defaults to COMPRESSION
+        :decoded: if True, store responses pickled rather than as JSON.
+            Defaults to DECODED
+        :max_size: the most bytes of responses to keep, or 0 for no limit.
+            Defaults to MAX_SIZE
+        """
+        self.__path = path
+        self.compression = compression
+        self.decoded = decoded
+        self.max_size = max_size
+        self.__conn = None
+        self.__lock = threading.RLock()
+        self.__size = None
+        # last-access times not yet written, so that reads don't each need
+        # a write transaction
+        self.__touched = {}
+
+    @property
+    def path(self):
+        if self.__path is None:
+            self.__path = os.path.join(get_cachedir(), "cache.sqlite")
+        return self.__path
+
+    @property
+    def legacy_path(self):
+        """The single-pickle cache file used by earlier versions"""
+        return os.path.join(os.path.dirname(self.path), "cache")
+
+    @property
+    def conn(self):
+        with self.__lock:
+            if self.__conn is None:
+                cachedir = os.path.dirname(self.path)
+                if cachedir and not os.path.exists(cachedir):
+                    os.makedirs(cachedir)
+                try:
+                    conn = connect(self.path)
+                    self.__upgrade(conn)
+                except sqlite3.DatabaseError as err:
+                    if not is_corruption(err):
+                        raise
+                    self.__salvage()
+                    conn = connect(self.path)
+                    self.__upgrade(conn)
+                self.__conn = conn
+                if os.path.exists(self.legacy_path):
+                    self.migrate_pickle(self.legacy_path)
+            return self.__conn
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Run the block as one transaction holding the database's write lock,
+        waiting up to BUSY_TIMEOUT seconds for other writers
+        """
+        with self.__lock:
+            conn = self.conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    @staticmethod
+    def __upgrade(conn):
+        """Create or bring the schema of the database up to date"""
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # read the version under the write lock, so that two processes
+            # don't both upgrade
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            conn.execute("CREATE TABLE IF NOT EXISTS cache ("
+                         "url TEXT PRIMARY KEY, "
+                         "day INTEGER NOT NULL, "
+                         "response TEXT)")
+            if version < 1:
+                # responses were raw JSON text before entries were encoded
+                conn.execute("ALTER TABLE cache ADD COLUMN "
+                             "codec TEXT NOT NULL DEFAULT 'none'")
+                conn.execute("ALTER TABLE cache ADD COLUMN "
+                             "format TEXT NOT NULL DEFAULT 'json'")
+            if version < 2:
+                conn.execute("ALTER TABLE cache ADD COLUMN "
+                             "size INTEGER NOT NULL DEFAULT 0")
+                conn.execute("ALTER TABLE cache ADD COLUMN "
+                             "accessed INTEGER NOT NULL DEFAULT 0")
+                conn.execute("UPDATE cache SET size = length(response)")
+                conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed "
+                             "ON cache (accessed)")
+            if version < 3:
+                conn.execute("ALTER TABLE cache ADD COLUMN etag TEXT")
+                conn.execute("ALTER TABLE cache ADD COLUMN last_modified TEXT")
+            if version < 4:
+                # entries written before checksums were kept have none, and
+                # are checked by decoding them instead
+                conn.execute("ALTER TABLE cache ADD COLUMN checksum INTEGER")
+            conn.execute("CREATE TABLE IF NOT EXISTS coverage ("
+                         "url TEXT PRIMARY KEY, "
+                         "query TEXT NOT NULL, "
+                         "first_year INTEGER NOT NULL, "
+                         "last_year INTEGER NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS coverage_query "
+                         "ON coverage (query)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta ("
+                         "key TEXT PRIMARY KEY, "
+                         "value TEXT NOT NULL)")
+            conn.execute("PRAGMA user_version = {0:d}".format(
+                SCHEMA_VERSION))
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def __salvage(self):
+        """
+        Move a damaged database aside and rebuild it from the entries that
+        can still be read and decoded
+        """
+        broken = self.path + ".broken"
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(broken + suffix):
+                os.remove(broken + suffix)
+            if os.path.exists(self.path + suffix):
+                os.rename(self.path + suffix, broken + suffix)
+        rows = []
+        try:
+            old = sqlite3.connect(broken)
+        except sqlite3.DatabaseError:
+            old = None
+        if old is not None:
+            # the damage may be in the table or in any of its indexes, so
+            # gather row ids along every path, keeping partial scans
+            rowids = set()
+            for query in ("SELECT rowid FROM cache",
+                          "SELECT rowid FROM cache NOT INDEXED",
+                          "SELECT rowid FROM cache ORDER BY url",
+                          "SELECT rowid FROM cache ORDER BY accessed"):
+                try:
+                    for row in old.execute(query):
+                        rowids.add(row[0])
+                except sqlite3.DatabaseError:
+                    continue
+            for rowid in sorted(rowids):
+                try:
+                    cursor = old.execute(
+                        "SELECT * FROM cache WHERE rowid = ?", (rowid,))
+                    entry = dict(zip([i[0] for i in cursor.description],
+                                     cursor.fetchone()))
+                    url = entry["url"]
+                    codec = entry.get("codec", "none")
+                    fmt = entry.get("format", "json")
+                    data = entry["response"]
+                    decode(codec, fmt, data)
+                except Exception:
+                    continue
+                if isinstance(data, type("")):
+                    data = data.encode("utf-8")
+                rows.append((url, entry["day"], codec, fmt,
+                             sqlite3.Binary(data), len(data),
+                             entry.get("accessed", 0), entry.get("etag"),
+                             entry.get("last_modified"), checksum(data)))
+            old.close()
+        conn = connect(self.path)
+        try:
+            self.__upgrade(conn)
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT OR IGNORE INTO cache "
+                "(url, day, codec, format, response, size, accessed, etag, "
+                "last_modified, checksum) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(broken + suffix):
+                os.remove(broken + suffix)
+
+    def recover(self):
+        """
+        Rebuild the database from the entries that can still be read,
+        discarding only those that can't.  This is done automatically when
+        the database turns out to be damaged.
+        """
+        with self.__lock:
+            if self.__conn is not None:
+                try:
+                    self.__conn.close()
+                except sqlite3.Error:
+                    pass
+                self.__conn = None
+            self.__touched = {}
+            self.__size = None
+            self.__salvage()
+
+    def __flush_touched(self):
+        """Write pending last-access times; call within a transaction"""
+        if self.__touched:
+            self.conn.executemany(
+                "UPDATE cache SET accessed = ? WHERE url = ?",
+                [(accessed, url) for url, accessed in
+                 self.__touched.items()])
+            self.__touched = {}
+
+    def __evict(self):
+        """
+        Evict least recently used entries once the cache has outgrown
+        max_size, down to nine tenths of it; call within a transaction
+        """
+        max_size = self.max_size
+        if max_size is None:
+            max_size = MAX_SIZE
+        if not max_size:
+            return
+        if self.__size is None or self.__size > max_size:
+            # recount, as other processes may have evicted in the meantime
+            self.__size = self.conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        if self.__size <= max_size:
+            return
+        self.__flush_touched()
+        target = max_size * 9 // 10
+        cursor = self.conn.execute(
+            "SELECT url, size FROM cache ORDER BY accessed")
+        evicted = []
+        for url, size in cursor:
+            if self.__size <= target:
+                break
+            evicted.append((url,))
+            self.__size -= size
+        cursor.close()
+        self.conn.executemany("DELETE FROM cache WHERE url = ?", evicted)
+
+    def get(self, key, min_day=None):
+        """
+        Return the (day, response) entry for key, or None if there is none.
+        Entries older than min_day are neither read nor decoded.  An entry
+        that fails its checksum or can't be decoded is discarded.
+
+        :key: the url of the entry
+        :min_day: if given, the earliest day of an entry to return
+        """
+        with self.__lock:
+            try:
+                row = self.conn.execute(
+                    "SELECT day, codec, format, response, checksum "
+                    "FROM cache WHERE url = ? AND day >= ?",
+                    (key, -1 if min_day is None else min_day)).fetchone()
+            except sqlite3.DatabaseError as err:
+                if not is_corruption(err):
+                    raise
+                self.recover()
+                return None
+            if row is None:
+                return None
+            self.__touched[key] = int(time.time() * 1000)
+            if len(self.__touched) >= TOUCH_BATCH:
+                with self.transaction():
+                    self.__flush_touched()
+        day, codec, fmt, data, crc = row
+        try:
+            if crc is not None and checksum(data) != crc:
+                raise ValueError("Checksum mismatch")
+            return day, decode(codec, fmt, data)
+        except Exception:
+            self.discard(key)
+            return None
+
+    def discard(self, key):
+        """
+        Remove the entry for key, if there is one
+
+        :key: the url of the entry
+        """
+        with self.transaction():
+            self.__touched.pop(key, None)
+            self.conn.execute("DELETE FROM cache WHERE url = ?", (key,))
+            self.__size = None
+
+    def __getitem__(self, key):
+        entry = self.get(key)
+        if entry is None:
+            raise KeyError(key)
+        return entry
+
+    def __setitem__(self, key, value):
+        day, response = value
+        self.put(key, day, response)
+
+    def put(self, key, day, response, etag=None, last_modified=None):
+        """
+        Store an entry
+
+        :key: the url of the entry
+        :day: the day the response was fetched
+        :response: the decoded response
+        :etag: the ETag header sent with the response, if any
+        :last_modified: the Last-Modified header sent with the response, if
+            any
+        """
+        codec, fmt, data = encode(response, self.compression, self.decoded)
+        try:
+            self.__put(key, day, codec, fmt, data, etag, last_modified)
+        except sqlite3.DatabaseError as err:
+            if not is_corruption(err):
+                raise
+            self.recover()
+            self.__put(key, day, codec, fmt, data, etag, last_modified)
+
+    def __put(self, key, day, codec, fmt, data, etag, last_modified):
+        """Store an encoded entry"""
+        with self.transaction() as conn:
+            self.__flush_touched()
+            old = conn.execute(
+                "SELECT size FROM cache WHERE url = ?", (key,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache "
+                "(url, day, codec, format, response, size, accessed, "
+                "etag, last_modified, checksum) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, day, codec, fmt, sqlite3.Binary(data), len(data),
+                 int(time.time() * 1000), etag, last_modified,
+                 checksum(data)))
+            if self.__size is not None:
+                self.__size += len(data) - (old[0] if old else 0)
+            self.__evict()
+
+    def validators(self, key):
+        """
+        Return the (etag, last_modified) validators stored with an entry,
+        each None if absent, without reading the response
+
+        :key: the url of the entry
+        :returns: the validators, or None if there is no entry for key
+        """
+        with self.__lock:
+            try:
+                row = self.conn.execute(
+                    "SELECT etag, last_modified FROM cache WHERE url = ?",
+                    (key,)).fetchone()
+            except sqlite3.DatabaseError as err:
+                if not is_corruption(err):
+                    raise
+                self.recover()
+                return None
+        if row is None:
+            return None
+        return tuple(row)
+
+    def refresh(self, key, day):
+        """
+        Mark an entry as fetched on day, as when the API confirms it is
+        unchanged
+
+        :key: the url of the entry
+        :day: the day to record
+        """
+        with self.transaction() as conn:
+            conn.execute("UPDATE cache SET day = ? WHERE url = ?", (day, key))
+
+    def cover(self, key, query, first, last):
+        """
+        Record that the entry for key is the first page of a query for the
+        data of query from the years first to last
+
+        :key: the url of the first page
+        :query: identifies the data, whatever the years
+        :first: the first year covered
+        :last: the last year covered
+        """
+        with self.__lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM coverage WHERE url = ? AND query = ? AND "
+                "first_year = ? AND last_year = ?",
+                (key, query, first, last)).fetchone()
+            if row is not None:
+                return
+            with self.transaction() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO coverage "
+                    "(url, query, first_year, last_year) VALUES (?, ?, ?, ?)",
+                    (key, query, first, last))
+
+    def coverage(self, query, min_day=None):
+        """
+        Return the years of the data of query held in the cache, as a list
+        of (first, last, key) tuples, where key is the url of the first
+        page.  Only queries whose first page is still cached, and no older
+        than min_day, are listed.
+
+        :query: identifies the data, as passed to cover
+        :min_day: if given, the earliest day of a first page to consider
+        """
+        with self.__lock:
+            try:
+                rows = self.conn.execute(
+                    "SELECT coverage.first_year, coverage.last_year, "
+                    "coverage.url FROM coverage JOIN cache "
+                    "ON cache.url = coverage.url "
+                    "WHERE coverage.query = ? AND cache.day >= ?",
+                    (query, -1 if min_day is None else min_day)).fetchall()
+            except sqlite3.DatabaseError as err:
+                if not is_corruption(err):
+                    raise
+                self.recover()
+                return []
+        return [tuple(row) for row in rows]
+
+    def get_meta(self, key):
+        """
+        Return the metadata stored under key, or None if there is none
+
+        :key: the name of the metadata
+        """
+        with self.__lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = ?",
+                                    (key,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def set_meta(self, key, value):
+        """
+        Store metadata under key.  Metadata is kept apart from the entries,
+        so it is never evicted, but it is removed by clear.
+
+        :key: the name of the metadata
+        :value: any value that can be serialized as JSON
+        """
+        with self.transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) "
+                         "VALUES (?, ?)", (key, json.dumps(value)))
+
+    def __delitem__(self, key):
+        with self.transaction() as conn:
+            self.__touched.pop(key, None)
+            cursor = conn.execute("DELETE FROM cache WHERE url = ?", (key,))
+            self.__size = None
+        if not cursor.rowcount:
+            raise KeyError(key)
+
+    def __contains__(self, item):
+        with self.__lock:
+            row = self.conn.execute("SELECT 1 FROM cache WHERE url = ?",
+                                    (item,)).fetchone()
+        return row is not None
+
+    def __len__(self):
+        with self.__lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    @property
+    def size(self):
+        """The total bytes of the stored responses"""
+        with self.__lock:
+            return self.conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+
+    def clear(self):
+        """Remove every entry from the cache"""
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM cache")
+            conn.execute("DELETE FROM coverage")
+            conn.execute("DELETE FROM meta")
+            self.__touched = {}
+            self.__size = 0
+
+    def close(self):
+        """Close the underlying database connection"""
+        with self.__lock:
+            if self.__conn is not None:
+                with self.transaction():
+                    self.__flush_touched()
+                self.__conn.close()
+                self.__conn = None
+                self.__size = None
+
+    def migrate_pickle(self, path):
+        """
+        Import the entries of a pickle cache written by earlier versions of
+        wbdata, then remove the pickle file
+
+        :path: the pickle file to migrate
+        :returns: the number of entries imported
+        """
+        try:
+            with open(path, 'rb') as cachefile:
+                try:
+                    old = pickle.load(cachefile, encoding="ascii",
+                                      errors="replace")
+                except TypeError:
+                    old = pickle.load(cachefile)
+        except IOError:
+            return 0
+        except Exception:
+            old = {}
+        rows = []
+        if isinstance(old, dict):
+            for url, value in old.items():
+                try:
+                    day, response = value
+                    day = int(day)
+                    response = json.loads(response)
+                except (TypeError, ValueError):
+                    continue
+                codec, fmt, data = encode(response, self.compression,
+                                          self.decoded)
+                rows.append((url, day, codec, fmt, sqlite3.Binary(data),
+                             len(data), checksum(data)))
+        with self.transaction() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO cache "
+                "(url, day, codec, format, response, size, checksum) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self.__size = None
+            self.__evict()
+        try:
+            os.remove(path)
+        except OSError:
+            # another process migrated it first
+            pass
+        return len(rows)
@@ -0,0 +1,222 @@
+"""
+wbdata.cube: indicator values as a dense indicator x country x date array
+"""
+
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+import datetime
+import json
+import os
+
+import numpy as np
+
+AXES = ("indicators", "countries", "dates")
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+class Cube(object):
+    """
+    A three-dimensional float64 array of indicator values, with NaN where
+    there is no value, and the labels of the positions along each axis.
+    The axes are named "indicators", "countries" and "dates", in the order
+    given by axes; indicators are labelled by column name, and countries and
+    dates are sorted.
+
+    The array can be memory-mapped from a file, as written by get_cube with
+    a path or by save, so that cubes larger than memory can be sliced.
+    """
+
+    def __init__(self, values, labels, axes=AXES):
+        """
+        :values: a three-dimensional numpy array
+        :labels: a sequence of three sequences, labelling the positions
+            along each axis
+        :axes: the names of the axes, in the order of the array's dimensions
+        """
+        self.values = values
+        self.axes = tuple(axes)
+        self.labels = [list(i) for i in labels]
+        self.index = [dict((label, position) for position, label in
+                           enumerate(i)) for i in self.labels]
+        if sorted(self.axes) != sorted(AXES):
+            raise ValueError("Bad value for axes")
+        if tuple(len(i) for i in self.labels) != values.shape:
+            raise ValueError("Labels do not match the shape of values")
+
+    @classmethod
+    def from_frame(cls, df, path=None):
+        """
+        Make a cube from a DataFrame returned by get_dataframe with
+        keep_levels=True
+
+        :df: the DataFrame, indexed by country and date, with a column per
+            indicator
+        :path: if given, a .npy file to hold the values, memory-mapped
+            rather than in memory
+        """
+        if df.index.nlevels != 2:
+            raise ValueError("DataFrame must be indexed by country and date")
+        labels = [list(df.columns)]
+        positions = []
+        for level, codes in zip(df.index.levels, df.index.codes):
+            names = list(level)
+            order = sorted(range(len(names)), key=names.__getitem__)
+            rank = np.empty(len(order), dtype="int64")
+            rank[order] = np.arange(len(order))
+            labels.append([names[i] for i in order])
+            positions.append(rank[codes])
+        shape = tuple(len(i) for i in labels)
+        if path is None:
+            values = np.full(shape, np.nan)
+        else:
+            values = np.lib.format.open_memmap(path, mode="w+",
+                                               dtype="float64", shape=shape)
+            values[...] = np.nan
+        values[:, positions[0], positions[1]] = df.to_numpy(
+            dtype="float64").T
+        cube = cls(values, labels)
+        if path is not None:
+            cube.save(path)
+        return cube
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        """
+        Open a cube written by save
+
+        :path: the .npy file holding the values
+        :mmap_mode: how to memory-map the values, as numpy.load takes it, or
+            None to read them into memory
+        """
+        with open(path + ".json") as labels_file:
+            saved = json.load(labels_file)
+        labels = []
+        for axis_labels, dated in zip(saved["labels"], saved["dated"]):
+            if dated:
+                axis_labels = [datetime.datetime.strptime(i, DATE_FORMAT)
+                               for i in axis_labels]
+            labels.append(axis_labels)
+        return cls(np.load(path, mmap_mode=mmap_mode), labels, saved["axes"])
+
+    def save(self, path):
+        """
+        Write the cube to path, a .npy file that numpy.load can memory-map,
+        with its labels in path + ".json"
+        """
+        if (isinstance(self.values, np.memmap) and
+                self.values.filename == os.path.abspath(path)):
+            # written in place
+            self.values.flush()
+        else:
+            with open(path, "wb") as values_file:
+                np.save(values_file, self.values)
+        dated = [bool(i) and all(isinstance(j, datetime.datetime) for j in i)
+                 for i in self.labels]
+        labels = [[j.strftime(DATE_FORMAT) for j in i] if is_dated else i
+                  for i, is_dated in zip(self.labels, dated)]
+        with open(path + ".json", "w") as labels_file:
+            json.dump({"axes": list(self.axes), "labels": labels,
+                       "dated": dated}, labels_file)
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def indicators(self):
+        return self.labels[self.axis("indicators")]
+
+    @property
+    def countries(self):
+        return self.labels[self.axis("countries")]
+
+    @property
+    def dates(self):
+        return self.labels[self.axis("dates")]
+
+    def axis(self, name):
+        """Return the position of the axis called name"""
+        try:
+            return self.axes.index(name)
+        except ValueError:
+            raise ValueError("Bad axis {0}".format(name))
+
+    def xs(self, name, label):
+        """
+        Return the two-dimensional slice of the values at label along the
+        axis name, as a view rather than a copy
+
+        :name: "indicators", "countries" or "dates"
+        :label: the label of the slice
+        """
+        axis = self.axis(name)
+        key = [slice(None)] * 3
+        key[axis] = self.index[axis][label]
+        return self.values[tuple(key)]
+
+    def select(self, **labels):
+        """
+        Return a cube of some of the labels along any of the axes, as in
+        cube.select(countries=["Chile", "Peru"], dates=dates[-10:])
+
+        :labels: for each axis to restrict, a label or sequence of labels
+        """
+        values = self.values
+        selected = list(self.labels)
+        for name, wanted in labels.items():
+            axis = self.axis(name)
+            if not isinstance(wanted, (list, tuple)):
+                wanted = [wanted]
+            values = np.take(values, [self.index[axis][i] for i in wanted],
+                             axis=axis)
+            selected[axis] = wanted
+        return Cube(values, selected, self.axes)
+
+    def transpose(self, items="indicators", major_axis="dates"):
+        """
+        Return the cube with its axes in the order of a pandas Panel with
+        the given items and major axis, as get_panel takes them.  The
+        values are a view rather than a copy.
+
+        :items: one of "indicators", "countries", "dates"
+        :major_axis: one of "indicators", "countries", "dates"
+        """
+        if items == major_axis:
+            raise ValueError("Cannot have the same value for items and "
+                             "major_axis")
+        if items not in AXES:
+            raise ValueError("Bad value for items")
+        if major_axis not in AXES:
+            raise ValueError("Bad value for major_axis")
+        minor_axis = [i for i in AXES if i not in (items, major_axis)][0]
+        order = [self.axis(i) for i in (items, major_axis, minor_axis)]
+        return Cube(self.values.transpose(order),
+                    [self.labels[i] for i in order],
+                    [self.axes[i] for i in order])
+
+    def frame(self, name, label):
+        """
+        Return the slice at label along the axis name as a pandas
+        DataFrame, indexed by the first remaining axis
+
+        :name: "indicators", "countries" or "dates"
+        :label: the label of the slice
+        """
+        import pandas as pd
+        rows, columns = [i for i in range(3) if i != self.axis(name)]
+        return pd.DataFrame(self.xs(name, label), index=self.labels[rows],
+                            columns=self.labels[columns])
+
+    def frames(self, items="indicators", major_axis="dates"):
+        """
+        Return a DataFrame for each item, indexed by the major axis, as the
+        items of the Panel get_panel returned
+
+        :items: one of "indicators", "countries", "dates"
+        :major_axis: one of "indicators", "countries", "dates"
+        :returns: a dictionary of item labels to DataFrames
+        """
+        cube = self.transpose(items, major_axis)
+        return dict((label, cube.frame(items, label))
+                    for label in cube.labels[0])
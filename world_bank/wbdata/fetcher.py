@@ -5,94 +5,66 @@ wbdata.fetcher: retrieve and cache queries
 from __future__ import (print_function, division, absolute_import,
                         unicode_literals)
 
+import base64
 import json
-import os
-import sys
 import datetime
+import random
+import re
+import socket
+import threading
+import time
 import warnings
+import zlib
+from collections import deque
 
 try:  # python 2
     import cPickle as pickle
-
-    from urllib import urlencode
-    from urllib2 import URLError
-    from urllib2 import urlopen
+    import httplib
+    from Queue import Empty, Full, LifoQueue
+    from urllib import unquote, urlencode
+    from urlparse import urljoin, urlsplit
 except ImportError:  # python 3
+    import http.client as httplib
     import pickle
+    from queue import Empty, Full, LifoQueue
+    from urllib.parse import unquote, urlencode, urljoin, urlsplit
 
-    from urllib.request import urlopen
-    from urllib.error import URLError
-    from urllib.parse import urlencode
+from . import hooks
+from .cache import Cache
+from .metrics import Metrics
+from .ratelimit import SharedTokenBucket, TokenBucket
 
 PER_PAGE = 1000
+MAX_PER_PAGE = 20000
+COUNTRY_CHUNK = 50
+ALL_COUNTRIES = 300
+FIRST_YEAR = 1960
 TRIES = 5
-
-
-class Cache(object):
-    """Docstring for Cache """
-
-    def __init__(self):
-        """@todo: to be defined """
-        self.__path = None
-        self.__cache = None
-
-    @property
-    def path(self):
-        if self.__path is None:
-            # Inspiration for below from Trent Mick and Sridhar Ratnakumar
-            # <http://pypi.python.org/pypi/appdirs/1.2.0>
-            if sys.platform.startswith("win"):
-                basedir = os.path.join(os.getenv("LOCALAPPDATA", os.getenv(
-                    "APPDATA", os.path.expanduser("~"))), "wbdata")
-            elif sys.platform is "darwin":
-                basedir = os.path.expanduser('~/Library/Caches')
-            else:
-                basedir = os.getenv('XDG_CACHE_HOME',
-                                    os.path.expanduser('~/.cache'))
-            cachedir = os.path.join(basedir, 'wbdata')
-            if not os.path.exists(cachedir):
-                os.makedirs(cachedir)
-            self.__path = os.path.join(cachedir, "cache")
-        return self.__path
-
-    @property
-    def cache(self):
-        if self.__cache is None:
-            try:
-                with open(self.path, 'rb') as cachefile:
-                    try:
-                        cache = pickle.load(cachefile, encoding="ascii",
-                                            errors="replace")
-                    except TypeError:
-                        cache = pickle.load(cachefile)
-            except IOError:
-                cache = {}
-            self.__cache = cache
-        return self.__cache
-
-    def __getitem__(self, key):
-        return self.cache[key]
-
-    def __setitem__(self, key, value):
-        self.cache[key] = value
-        self.sync()
-
-    def __contains__(self, item):
-        return item in self.cache
-
-    def sync(self):
-        """Sync cache to disk"""
-        with open(self.path, 'wb') as cachefile:
-            pickle.dump(self.cache, cachefile, protocol=2)
+THREADS = 4
+POOL_SIZE = 4
+TIMEOUT = 30
+BACKOFF = 0.5
+BACKOFF_MAX = 30
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 30
+MAX_REDIRECTS = 5
+REDIRECTS = (301, 302, 303, 307, 308)
+ALL_YEARS = (0, 9999)
+REFRESH_YEARS = 2
+FULL_REFRESH = 30
 
 CACHE = Cache()
-if not len(CACHE.cache)== 0:
-    try:
-        assert type(CACHE[tuple(CACHE.cache.keys())[0]]) == int
-    except AssertionError:
-        os.remove(CACHE.path)
-        CACHE = Cache()
+METRICS = Metrics()
+LIMITER = None
 EXP = 1
+TTL = {
+    "countries": 7,
+    "incomeLevels": 30,
+    "indicators": 7,
+    "lendingTypes": 30,
+    "sources": 7,
+    "topics": 30,
+}
 
 def daycount(date=None):
     if date is None:
@@ -100,68 +72,1135 @@ def daycount(date=None):
     return (date - datetime.datetime(2000, 1, 1)).days
 
 
-def fetch_url(url):
+def thread_pool(threads):
     """
-    Fetch a url directly from the World Bank, up to TRIES tries
+    Return a pool of threads.  multiprocessing is imported here rather than
+    with this module, as it is slow to import.
 
-    :url: the  url to retrieve
-    :returns: a string with the url contents
+    :threads: the number of threads
+    """
+    from multiprocessing.pool import ThreadPool
+    return ThreadPool(threads)
+
+
+def url_family(url):
+    """
+    Return the kind of resource a url queries: "data" for indicator values,
+    otherwise the endpoint, such as "countries", "indicators" or "topics"
+    """
+    segments = urlsplit(url).path.split("/")
+    if "indicators" in segments or "indicator" in segments:
+        if "countries" in segments:
+            return "data"
+        return "indicators"
+    for segment in segments:
+        if segment in TTL:
+            return segment
+    return None
+
+
+def get_ttl(url):
+    """
+    Return the days a cached response for url stays fresh: the TTL of its
+    family, or EXP for data and anything not listed in TTL
+    """
+    return TTL.get(url_family(url), EXP)
+
+
+def country_codes(query_url):
+    """
+    Return the country codes a query url names, or None if it names none
+    or asks for all countries
+    """
+    segments = query_url.split("/")
+    if "countries" not in segments:
+        return None
+    index = segments.index("countries") + 1
+    if index >= len(segments) or segments[index] in ("", "indicators"):
+        return None
+    codes = segments[index].split(";")
+    if "all" in (i.lower() for i in codes):
+        return None
+    return codes
+
+
+def split_countries(query_url):
+    """
+    Split a query url naming more than COUNTRY_CHUNK countries into urls
+    naming at most that many each, so that urls stay short
+
+    :query_url: the base url to be queried
+    :returns: a list of query urls, holding just query_url if it is short
+        enough
+    """
+    codes = country_codes(query_url)
+    if codes is None or len(codes) <= COUNTRY_CHUNK:
+        return [query_url]
+    segments = query_url.split("/")
+    index = segments.index("countries") + 1
+    return ["/".join(segments[:index] +
+                     [";".join(codes[i:i + COUNTRY_CHUNK])] +
+                     segments[index + 1:])
+            for i in range(0, len(codes), COUNTRY_CHUNK)]
+
+
+def page_size(query_url, args=None):
+    """
+    Return the page size that fetches a query in as few requests as
+    possible.  Lists of countries, indicators and the like are fetched
+    MAX_PER_PAGE at a time.  For indicator data, the number of records is
+    estimated from the indicators, countries and years asked for, and the
+    page size is that rounded up to a multiple of PER_PAGE, up to
+    MAX_PER_PAGE, so that the same query always has the same page urls.
+
+    :query_url: the base url to be queried
+    :args: a sequence of GET argument pairs
+    """
+    family = url_family(query_url)
+    if family is None:
+        return PER_PAGE
+    if family != "data":
+        return MAX_PER_PAGE
+    codes = country_codes(query_url)
+    countries = ALL_COUNTRIES if codes is None else len(codes)
+    indicators = len(query_url.rsplit("/", 1)[1].split(";"))
+    years = datetime.date.today().year - FIRST_YEAR + 1
+    for name, value in args or ():
+        if name == "mrv":
+            years = int(value)
+        elif name == "date":
+            dates = str(value).split(":")
+            try:
+                years = int(dates[-1][:4]) - int(dates[0][:4]) + 1
+            except ValueError:
+                pass
+    pages = -(-countries * indicators * max(1, years) // PER_PAGE)
+    return max(PER_PAGE, min(MAX_PER_PAGE, pages * PER_PAGE))
+
+
+def range_query(query_url, args=None):
+    """
+    Describe a query for indicator data by the data it asks for, so that it
+    can be answered from cached queries for more years of the same data.
+    Only queries whose sole argument is a year or range of years qualify.
+
+    :query_url: the base url to be queried
+    :args: a sequence of GET argument pairs
+    :returns: a (query, first, last) tuple, where query identifies the
+        indicator and countries whatever the years, and first and last are
+        the years asked for; or None if the query doesn't qualify
+    """
+    if "/indicators/" not in query_url or url_family(query_url) != "data":
+        return None
+    args = list(args or [])
+    if len(args) > 1 or any(name != "date" for name, value in args):
+        return None
+    if args:
+        match = re.match(r"^(\d{4})(?::(\d{4}))?$", str(args[0][1]))
+        if match is None:
+            return None
+        first = int(match.group(1))
+        last = int(match.group(2) or first)
+    else:
+        first, last = ALL_YEARS
+    head, indicator = query_url.rsplit("/indicators/", 1)
+    head, countries = head.rsplit("/", 1)
+    countries = ";".join(sorted(set(countries.lower().split(";"))))
+    query = "/".join((head, countries, "indicators", indicator))
+    return query, first, last
+
+
+def cover_range(ranges, first, last):
+    """
+    Choose cached ranges of years that together cover first to last, as
+    few as possible
+
+    :ranges: a sequence of (first, last, key) tuples
+    :first: the first year needed
+    :last: the last year needed
+    :returns: a list of (key, first, last) tuples giving the years to take
+        from each range chosen, or None if the ranges leave a gap
+    """
+    pieces = []
+    year = first
+    while year <= last:
+        best = None
+        for start, end, key in ranges:
+            if start <= year <= end and (best is None or end > best[1]):
+                best = (start, end, key)
+        if best is None:
+            return None
+        pieces.append((best[2], year, min(best[1], last)))
+        year = best[1] + 1
+    return pieces
+
+
+class ConnectionPool(object):
+    """
+    A thread-safe pool of keep-alive HTTP connections, kept per host.
+    Responses are requested gzipped and decoded transparently.  Redirects
+    are followed, and requests go through the proxy named by the http_proxy
+    or https_proxy environment variable unless no_proxy exempts the host.
+    """
+
+    def __init__(self, maxsize=None, timeout=None):
+        """
+        :maxsize: the most idle connections to keep for each host.  Defaults
+            to POOL_SIZE
+        :timeout: the socket timeout in seconds.  Defaults to TIMEOUT
+        """
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.__pools = {}
+        self.__lock = threading.Lock()
+
+    def _pool(self, key):
+        with self.__lock:
+            if key not in self.__pools:
+                maxsize = self.maxsize
+                if maxsize is None:
+                    maxsize = POOL_SIZE
+                self.__pools[key] = LifoQueue(maxsize)
+            return self.__pools[key]
+
+    def _proxy(self, scheme, host):
+        """
+        Return the proxy to reach host through, as a (netloc, authorization)
+        tuple, where authorization is the Proxy-Authorization header for
+        credentials given in the proxy url or None; or None to connect
+        directly
+        """
+        try:  # python 2
+            from urllib import getproxies, proxy_bypass
+        except ImportError:  # python 3
+            from urllib.request import getproxies, proxy_bypass
+        proxy = getproxies().get(scheme)
+        if not proxy or proxy_bypass(host):
+            return None
+        if "//" not in proxy:
+            proxy = "http://" + proxy
+        parts = urlsplit(proxy)
+        authorization = None
+        if parts.username:
+            credentials = ":".join((unquote(parts.username),
+                                    unquote(parts.password or "")))
+            authorization = "Basic " + base64.b64encode(
+                credentials.encode("utf-8")).decode("ascii")
+        return parts.netloc.rsplit("@", 1)[-1], authorization
+
+    def _new_conn(self, key):
+        scheme, netloc, proxy = key
+        timeout = self.timeout
+        if timeout is None:
+            timeout = TIMEOUT
+        METRICS.incr("connections_opened")
+        if proxy is None:
+            if scheme == "https":
+                return httplib.HTTPSConnection(netloc, timeout=timeout)
+            return httplib.HTTPConnection(netloc, timeout=timeout)
+        proxy_netloc, authorization = proxy
+        if scheme == "https":
+            # tunnel through the proxy with CONNECT
+            conn = httplib.HTTPSConnection(proxy_netloc, timeout=timeout)
+            tunnel_headers = None
+            if authorization:
+                tunnel_headers = {"Proxy-Authorization": authorization}
+            conn.set_tunnel(netloc, headers=tunnel_headers)
+            return conn
+        return httplib.HTTPConnection(proxy_netloc, timeout=timeout)
+
+    def _put_conn(self, key, conn):
+        try:
+            self._pool(key).put_nowait(conn)
+        except Full:
+            conn.close()
+
+    def request(self, url, headers=None):
+        """
+        Make a GET request, reusing an idle connection to the host if there
+        is one, and following up to MAX_REDIRECTS redirects
+
+        :url: the url to request
+        :headers: a dictionary of extra request headers
+        :returns: a (status, headers, body) tuple, with the body decompressed
+        """
+        request_headers = {"Accept-Encoding": "gzip"}
+        if headers:
+            request_headers.update(headers)
+        for _ in range(MAX_REDIRECTS + 1):
+            status, response_headers, body = self._request(url,
+                                                           request_headers)
+            if status not in REDIRECTS or "location" not in response_headers:
+                break
+            url = urljoin(url, response_headers["location"])
+        return status, response_headers, body
+
+    def _request(self, url, request_headers):
+        """Make a single GET request, as request does"""
+        parts = urlsplit(url)
+        proxy = self._proxy(parts.scheme, parts.hostname)
+        key = (parts.scheme, parts.netloc, proxy)
+        path = parts.path or "/"
+        if parts.query:
+            path = "?".join((path, parts.query))
+        if proxy is not None and parts.scheme == "http":
+            # plain http goes through the proxy by absolute url
+            path = "{0}://{1}{2}".format(parts.scheme, parts.netloc, path)
+            if proxy[1]:
+                request_headers = dict(request_headers)
+                request_headers["Proxy-Authorization"] = proxy[1]
+        try:
+            conn, reused = self._pool(key).get_nowait(), True
+        except Empty:
+            conn, reused = self._new_conn(key), False
+        while True:
+            try:
+                conn.request("GET", path, headers=request_headers)
+                response = conn.getresponse()
+                body = response.read()
+                break
+            except socket.timeout:
+                conn.close()
+                raise
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                if not reused:
+                    raise
+                # the server may have dropped an idle connection; retry once
+                # on a fresh one
+                conn, reused = self._new_conn(key), False
+        response_headers = dict((k.lower(), v) for k, v in
+                                response.getheaders())
+        METRICS.incr("bytes_downloaded", len(body))
+        if response.will_close:
+            conn.close()
+        else:
+            self._put_conn(key, conn)
+        if response_headers.get("content-encoding") == "gzip":
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        return response.status, response_headers, body
+
+    def clear(self):
+        """Close all idle connections"""
+        with self.__lock:
+            pools, self.__pools = self.__pools, {}
+        for pool in pools.values():
+            while True:
+                try:
+                    pool.get_nowait().close()
+                except Empty:
+                    break
+
+
+class CircuitBreaker(object):
+    """
+    Pause every fetch for a while once too many requests have failed in a
+    row, rather than have each worker keep retrying against a struggling
+    API
+    """
+
+    def __init__(self, threshold=None, cooldown=None):
+        """
+        :threshold: the number of consecutive failures that opens the
+            breaker.  Defaults to BREAKER_THRESHOLD
+        :cooldown: the seconds to pause once open.  Defaults to
+            BREAKER_COOLDOWN
+        """
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_until = 0
+        self.__lock = threading.Lock()
+
+    def wait(self):
+        """Block until the breaker is closed"""
+        with self.__lock:
+            delay = self.opened_until - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+    def success(self):
+        """Record a successful request"""
+        with self.__lock:
+            self.failures = 0
+
+    def failure(self):
+        """Record a failed request, opening the breaker if need be"""
+        threshold = self.threshold
+        if threshold is None:
+            threshold = BREAKER_THRESHOLD
+        cooldown = self.cooldown
+        if cooldown is None:
+            cooldown = BREAKER_COOLDOWN
+        with self.__lock:
+            self.failures += 1
+            if self.failures >= threshold:
+                METRICS.incr("breaker_opened")
+                self.opened_until = time.time() + cooldown
+                # let one request through after the cooldown; if it fails
+                # too, open again straight away
+                self.failures = threshold - 1
+
+
+class SingleFlight(object):
+    """
+    Run a function once for concurrent calls with the same key, handing its
+    result to every caller.  Callers that waited on another's call get
+    their own copy of the result, as responses are modified in place
+    downstream.
+    """
+
+    def __init__(self):
+        self.__flights = {}
+        self.__lock = threading.Lock()
+
+    def do(self, key, func, *args):
+        """
+        Call func(*args), unless a call for key is already in flight, in
+        which case wait for it and return a copy of its result
+
+        :key: identifies calls that can share a result
+        :func: the function to call
+        """
+        with self.__lock:
+            flight = self.__flights.get(key)
+            if flight is None:
+                flight = self.__flights[key] = {"done": threading.Event(),
+                                                "waiters": 0}
+                leader = True
+            else:
+                flight["waiters"] += 1
+                leader = False
+        METRICS.incr("flights" if leader else "coalesced")
+        if not leader:
+            flight["done"].wait()
+            if "error" in flight:
+                raise flight["error"]
+            return pickle.loads(flight["result"])
+        try:
+            result = func(*args)
+        except Exception as err:
+            flight["error"] = err
+            raise
+        else:
+            # no one can join once the flight is removed, so the count of
+            # waiters is final here
+            with self.__lock:
+                del self.__flights[key]
+                waiters = flight["waiters"]
+            if waiters:
+                flight["result"] = pickle.dumps(result,
+                                                pickle.HIGHEST_PROTOCOL)
+            return result
+        finally:
+            with self.__lock:
+                if self.__flights.get(key) is flight:
+                    del self.__flights[key]
+            flight["done"].set()
+
+    def stats(self):
+        """
+        Return a dictionary of the number of calls made and of the calls
+        that were coalesced into one already in flight
+        """
+        counters = METRICS.snapshot()["counters"]
+        return {"calls": counters.get("flights", 0),
+                "coalesced": counters.get("coalesced", 0)}
+
+
+POOL = ConnectionPool()
+BREAKER = CircuitBreaker()
+FLIGHTS = SingleFlight()
+
+
+def set_rate_limit(rate, burst=None, shared=False, path=None):
+    """
+    Limit the rate of requests made to the API by this process or, if
+    shared is True, by every process on the host sharing the same bucket
+
+    :rate: the sustained requests per second, or None for no limit
+    :burst: the most requests that can be made at once after a quiet
+        spell.  Defaults to rate, or 1 if rate is lower
+    :shared: if True, keep the bucket in a file shared between processes
+    :path: the file to keep a shared bucket in.  Defaults to
+        "ratelimit.sqlite" in the wbdata cache directory
+    """
+    global LIMITER
+    if rate is None:
+        LIMITER = None
+    elif shared:
+        LIMITER = SharedTokenBucket(rate, burst, path)
+    else:
+        LIMITER = TokenBucket(rate, burst)
+
+
+def backoff(attempt):
+    """
+    Return the seconds to wait before retry number attempt, growing
+    exponentially from BACKOFF up to BACKOFF_MAX with full jitter
+    """
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF * 2 ** attempt))
+
+
+def request_url(url, headers=None):
+    """
+    Request a url directly from the World Bank, up to TRIES tries.
+    Connection errors, timeouts and 5xx or 429 responses are retried after
+    an exponential backoff; other error statuses are not.
+
+    :url: the url to retrieve
+    :headers: a dictionary of extra request headers
+    :returns: a (status, headers, contents) tuple for a 200 or 304 response,
+        or None if there was no usable response
     """
     response = None
-    for i in range(TRIES):
+    error = None
+    for attempt in range(TRIES):
+        if attempt:
+            METRICS.incr("retries")
+            time.sleep(backoff(attempt - 1))
+        BREAKER.wait()
+        if LIMITER is not None:
+            METRICS.observe("rate_limit_seconds", LIMITER.acquire())
+        started = time.time()
         try:
-            query = urlopen(url)
-            response = query.read()
-            query.close()
-            break
-        except URLError:
+            status, response_headers, body = POOL.request(url, headers)
+        except (httplib.HTTPException, socket.error, zlib.error) as err:
+            METRICS.incr("request_errors")
+            BREAKER.failure()
+            error = err
             continue
+        METRICS.observe("request_seconds", time.time() - started)
+        if status in (200, 304):
+            BREAKER.success()
+            response = body
+            break
+        error = "HTTP status {0}".format(status)
+        if status < 500 and status != 429:
+            break
+        BREAKER.failure()
     if response is None:
+        METRICS.incr("fetch_failures")
+        warnings.warn("Failed to fetch {0}: {1}".format(url, error))
         return None
-        raise ValueError("Got no response")
     try:
-        return str(response, encoding="ascii", errors="replace")
+        response = str(response, encoding="ascii", errors="replace")
     except TypeError:
-        return str(response)
+        response = str(response)
+    return status, response_headers, response
 
 
-def fetch(query_url, args=None, cached=True):
-    """fetch data from the World Bank API or from cache
+def fetch_url(url):
+    """
+    Fetch a url directly from the World Bank, up to TRIES tries
 
-    :query_url: the base url to be queried
-    :args: a dictionary of GET arguments
+    :url: the  url to retrieve
+    :returns: a string with the url contents, or None if there was no
+        usable response
+    """
+    response = request_url(url)
+    if response is None:
+        return None
+    return response[2]
+
+
+def load_page(page_url, cached=True):
+    """
+    Fetch and decode a single page of a query, from the cache if it holds
+    a fresh copy.  If the cached copy has expired but the API sent
+    validators with it, it is revalidated with a conditional request and
+    reused, without downloading it again, if it is unchanged.
+
+    A page saying that its query has no data is returned with a warning,
+    so that callers can tell it from a failed fetch.
+
+    :page_url: the full url of the page
     :cached: use the cache
-    :returns: a list of dictionaries containing the response to the query
+    :returns: the decoded response, or None if there was no usable response
     """
-    if args is None:
-        args = []
-    args.extend((("format", "json"), ("per_page", PER_PAGE)))
-    query_url = "?".join((query_url, urlencode(args)))
-    results = []
-    original_url = query_url
-    pages, this_page = 0, 1
-    while pages != this_page:
-        if (cached and query_url in CACHE and daycount() - CACHE[query_url][0] < EXP):
-            raw_response = CACHE[query_url][1]
-        else:
-            raw_response = fetch_url(query_url)
-            CACHE[query_url] = (daycount(), raw_response)
-        if raw_response is None:
+    response = None
+    if cached:
+        started = time.time()
+        entry = CACHE.get(page_url, min_day=daycount() - get_ttl(page_url) + 1)
+        METRICS.observe("cache_read_seconds", time.time() - started)
+        if entry is not None:
+            METRICS.incr("cache_hits")
+            response = entry[1]
+    if response is None:
+        headers = {}
+        validators = CACHE.validators(page_url) if cached else None
+        if validators is not None:
+            METRICS.incr("cache_expired")
+            etag, last_modified = validators
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+        elif cached:
+            METRICS.incr("cache_misses")
+        result = request_url(page_url, headers)
+        if result is not None and result[0] == 304:
+            entry = CACHE.get(page_url)
+            if entry is not None:
+                METRICS.incr("cache_revalidated")
+                CACHE.refresh(page_url, daycount())
+                response = entry[1]
+            else:
+                # evicted since we asked; get it again in full
+                result = request_url(page_url)
+    if response is None:
+        if result is None:
             warnings.warn("There was no API response")
             return None
+        status, headers, raw_response = result
+        started = time.time()
         try:
             response = json.loads(raw_response)
         except:
             warnings.warn("There is no data in the API response")
             return None
-        if (response is None or response[0]['total'] == 0):
-            warnings.warn("There is no data in the API response")
+        elapsed = time.time() - started
+        METRICS.observe("decode_seconds", elapsed)
+        if hooks.HOOKS:
+            records = 0
+            if isinstance(response, list) and len(response) > 1:
+                records = len(response[1] or ())
+            hooks.fire("decode", elapsed, records)
+        CACHE.put(page_url, daycount(), response, headers.get("etag"),
+                  headers.get("last-modified"))
+    if response is None:
+        warnings.warn("There is no data in the API response")
+        return None
+    if is_empty(response):
+        warnings.warn("There is no data in the API response")
+    return response
+
+
+def is_empty(response):
+    """Return whether a decoded page says its query has no data"""
+    return response[0]['total'] == 0
+
+
+def fetch_page(page_url, cached=True):
+    """
+    Fetch and decode a single page of a query as load_page, sharing one
+    fetch between concurrent requests for the same page
+
+    :page_url: the full url of the page
+    :cached: use the cache
+    :returns: the decoded response, or None if there was no usable response
+    """
+    return FLIGHTS.do((page_url, cached), load_page, page_url, cached)
+
+
+def get_metrics():
+    """
+    Return the fetch metrics gathered so far, as a dictionary with
+    "counters" and "histograms".  Counters are:
+
+        cache_hits, cache_misses, cache_expired, cache_revalidated: how
+            cached pages were found
+        bytes_downloaded: bytes received, before decompression
+        connections_opened: new HTTP connections made
+        retries, request_errors, fetch_failures: retried requests, requests
+            that failed to connect or read, and urls given up on
+        breaker_opened: times the circuit breaker paused fetching
+        range_hits: queries for indicator data answered from cached
+            queries covering their years
+        series_refreshed: series downloaded or brought up to date by
+            fetch_incremental
+        flights, coalesced: page fetches made, and page requests that
+            waited on an identical fetch instead
+
+    Histograms, in seconds, are request_seconds (one per HTTP request),
+    decode_seconds (JSON parsing of a page), cache_read_seconds, and
+    rate_limit_seconds (waits for the rate limiter).
+    """
+    return METRICS.snapshot()
+
+
+def dump_metrics(fileobj):
+    """
+    Write the fetch metrics gathered so far to fileobj as JSON lines
+
+    :fileobj: a file-like object opened for writing text
+    """
+    METRICS.dump(fileobj)
+
+
+def reset_metrics():
+    """Clear the fetch metrics gathered so far"""
+    METRICS.reset()
+
+
+def build_url(query_url, args=None, per_page=None):
+    """
+    Return the url of the first page of a query
+
+    :query_url: the base url to be queried
+    :args: a sequence of GET argument pairs
+    :per_page: the number of records per page.  Defaults to the page size
+        chosen by page_size
+    :returns: the full url, with format and paging arguments added
+    """
+    if per_page is None:
+        per_page = page_size(query_url, args)
+    args = list(args or [])
+    args.extend((("format", "json"), ("per_page", per_page)))
+    return "?".join((query_url, urlencode(args)))
+
+
+def remaining_page_urls(query_url, response):
+    """
+    Return the urls of the pages of a query after the one in response
+
+    :query_url: the full url of the first page, as from build_url
+    :response: a decoded page of the query
+    """
+    return [query_url + "&page={0}".format(page) for page in
+            range(int(response[0]['page']) + 1,
+                  int(response[0]['pages']) + 1)]
+
+
+def collect_results(responses):
+    """
+    Return the records of a query's pages as one list, or None if any page
+    is missing
+
+    :responses: the decoded pages of the query, in page order
+    """
+    results = []
+    for response in responses:
+        if response is None:
             return None
-        results.extend(response[1])
-        this_page = response[0]['page']
-        pages = response[0]['pages']
-        query_url = original_url + "&page={0}".format(int(this_page) + 1)
+        results.extend(response[1] or ())
     for i in results:
         if "id" in i:
             i['id'] = i['id'].strip()
     return results
+
+
+def group_by_country(records):
+    """
+    Sort records in place so that each country's are together, countries
+    in the order they first appear, keeping the order of each country's
+    records
+
+    :records: a list of records of indicator data
+    """
+    order = {}
+    for i in records:
+        order.setdefault(i["country"]["id"], len(order))
+    records.sort(key=lambda i: order[i["country"]["id"]])
+
+
+def select_years(records, first, last):
+    """
+    Return the records of indicator data from the years first to last
+
+    :records: a list of records of indicator data
+    :first: the first year wanted
+    :last: the last year wanted
+    """
+    if (first, last) == ALL_YEARS:
+        return list(records)
+    return [i for i in records if first <= int(i["date"][:4]) <= last]
+
+
+def cached_page(page_url):
+    """
+    Return the decoded page at page_url if the cache holds a fresh copy, or
+    None
+    """
+    entry = CACHE.get(page_url, min_day=daycount() - get_ttl(page_url) + 1)
+    if entry is None:
+        return None
+    return entry[1]
+
+
+def fetch_covered(query, first, last):
+    """
+    Answer a query for indicator data from cached queries for the same
+    indicator and countries, without any request to the API
+
+    :query: the query, first and last years as returned by range_query
+    :returns: the list of records for the years asked for, empty if there
+        are none, or None if the cache doesn't hold every one of the years
+    """
+    min_day = daycount() - get_ttl(query) + 1
+    pieces = cover_range(CACHE.coverage(query, min_day), first, last)
+    if pieces is None:
+        return None
+    # take the latest years first, so that each country's records stay in
+    # the API's order of descending dates once grouped by country
+    pieces.sort(key=lambda piece: piece[1], reverse=True)
+    results = []
+    for page_url, start, end in pieces:
+        response = cached_page(page_url)
+        if response is None:
+            return None
+        responses = [response]
+        for url in remaining_page_urls(page_url, response):
+            responses.append(cached_page(url))
+        records = collect_results(responses)
+        if records is None:
+            return None
+        results.extend(select_years(records, start, end))
+    group_by_country(results)
+    if not results:
+        warnings.warn("There is no data in the API response")
+    return results
+
+
+def fetch_range(query_url, args=None, cached=True):
+    """
+    Answer a query for indicator data from cached queries covering its
+    years, as fetch and aio.fetch_async do before requesting it
+
+    :query_url: the base url to be queried
+    :args: a sequence of GET argument pairs
+    :cached: use the cache
+    :returns: the records as fetch_covered returns them, or None if the
+        query doesn't qualify, isn't covered, or cached is False
+    """
+    ranged = range_query(query_url, args)
+    if not cached or ranged is None:
+        return None
+    results = fetch_covered(*ranged)
+    if results is not None:
+        METRICS.incr("range_hits")
+    return results
+
+
+def cover_query(query_url, args, results):
+    """
+    Record the years of indicator data a fetched query holds, so that
+    queries for some of those years can be answered from it
+
+    :query_url: the base url queried
+    :args: a sequence of GET argument pairs
+    :results: the records fetched, or None if the fetch failed
+    """
+    ranged = range_query(query_url, args)
+    if results is not None and ranged is not None:
+        CACHE.cover(build_url(query_url, args), *ranged)
+
+
+def fetch(query_url, args=None, cached=True, threads=None):
+    """fetch data from the World Bank API or from cache
+
+    The first page is fetched on its own to learn how many pages there are;
+    the remaining pages are then fetched concurrently and reassembled in
+    page order.  A query naming more than COUNTRY_CHUNK countries is split
+    into queries for fewer countries, which are fetched concurrently and
+    their results joined.
+
+    A query for indicator data over a year or range of years is answered
+    from the cache if it holds fresh queries for the same indicator and
+    countries that between them cover those years, as after fetching all
+    years once.
+
+    :query_url: the base url to be queried
+    :args: a dictionary of GET arguments
+    :cached: use the cache
+    :threads: the most pages to fetch at once.  Defaults to THREADS
+    :returns: a list of dictionaries containing the response to the query,
+        or None if there is no data or any part of it couldn't be fetched
+    """
+    chunks = split_countries(query_url)
+    if len(chunks) > 1:
+        results = fetch_chunks(
+            lambda url: fetch_query(url, args, cached, threads), chunks,
+            threads)
+    else:
+        results = fetch_query(query_url, args, cached, threads)
+    return results or None
+
+
+def fetch_query(query_url, args=None, cached=True, threads=None):
+    """
+    Fetch a query naming at most COUNTRY_CHUNK countries, as fetch does
+
+    :query_url: the base url to be queried
+    :args: a sequence of GET argument pairs
+    :cached: use the cache
+    :threads: the most pages to fetch at once.  Defaults to THREADS
+    :returns: a list of dictionaries, empty if the API has no data for the
+        query, or None if any page couldn't be fetched
+    """
+    results = fetch_range(query_url, args, cached)
+    if results is not None:
+        return results
+    page_url = build_url(query_url, args)
+    response = fetch_page(page_url, cached)
+    if response is None:
+        return None
+    responses = [response]
+    page_urls = remaining_page_urls(page_url, response)
+    if page_urls:
+        if threads is None:
+            threads = THREADS
+        pool = thread_pool(max(1, min(threads, len(page_urls))))
+        try:
+            responses.extend(pool.map(lambda url: fetch_page(url, cached),
+                                      page_urls))
+        finally:
+            pool.close()
+    results = collect_results(responses)
+    cover_query(query_url, args, results)
+    return results
+
+
+def fetch_chunks(fetch_part, query_urls, threads=None):
+    """
+    Fetch the parts of a query split by split_countries concurrently, and
+    join their results
+
+    :fetch_part: called with the base url of each part, returning its
+        records, an empty list if it has none, or None if it couldn't be
+        fetched
+    :query_urls: the base urls of the parts
+    :threads: the most parts to fetch at once.  Defaults to THREADS
+    :returns: the records of every part as one list, or None if any part
+        couldn't be fetched
+    """
+    if threads is None:
+        threads = THREADS
+    pool = thread_pool(max(1, min(threads, len(query_urls))))
+    try:
+        parts = pool.map(fetch_part, query_urls)
+    finally:
+        pool.close()
+    return join_parts(parts)
+
+
+def join_parts(parts):
+    """
+    Return the records of the parts of a split query as one list, or None
+    if any part couldn't be fetched, so that a failed part never leaves a
+    silent hole in the results
+
+    :parts: the records of each part, in order, as fetch_query returns them
+    """
+    results = []
+    for part in parts:
+        if part is None:
+            return None
+        results.extend(part)
+    return results
+
+
+def series_key(query):
+    """
+    Return the cache key under which fetch_incremental keeps the series of
+    a query, as identified by range_query, and its metadata
+    """
+    return "series:" + query
+
+
+def merge_series(old, new, first, last):
+    """
+    Return a stored series with its records from the years first to last
+    replaced by newly fetched ones
+
+    :old: the records of the stored series
+    :new: the records fetched for the years first to last
+    :first: the first year fetched
+    :last: the last year fetched
+    """
+    # the new records are the latest, so putting them first keeps each
+    # country's records in descending order of date once grouped
+    merged = list(new)
+    merged.extend(i for i in old if not first <= int(i["date"][:4]) <= last)
+    group_by_country(merged)
+    return merged
+
+
+def fetch_incremental(query_url, args=None, years=None):
+    """
+    Fetch indicator data from a series kept up to date in the cache.  The
+    first call downloads every year of the indicator for the countries
+    queried; once that expires, only the last years of the series are
+    fetched again and merged into it.  The whole series is downloaded again
+    every FULL_REFRESH days, in case older values were revised.  A query
+    naming more than COUNTRY_CHUNK countries keeps a series for each part
+    split_countries makes of it.
+
+    :query_url: the base url of a query for indicator data
+    :args: a sequence of GET argument pairs; only a year or range of years
+        is allowed
+    :years: the number of latest years to fetch again.  Defaults to
+        REFRESH_YEARS
+    :returns: a list of dictionaries containing the response to the query,
+        or None if there is no data or any part of it couldn't be fetched
+    """
+    if range_query(query_url, args) is None:
+        raise ValueError("Only indicator data for a year or range of years "
+                         "can be fetched incrementally")
+    chunks = split_countries(query_url)
+    if len(chunks) > 1:
+        results = fetch_chunks(lambda url: fetch_series(url, args, years),
+                               chunks)
+    else:
+        results = fetch_series(query_url, args, years)
+    if results == []:
+        warnings.warn("There is no data in the API response")
+    return results or None
+
+
+def fetch_series(query_url, args=None, years=None):
+    """
+    Fetch indicator data for at most COUNTRY_CHUNK countries from a series
+    kept up to date in the cache, as fetch_incremental does
+
+    :query_url: the base url of a query for indicator data
+    :args: a sequence of GET argument pairs; only a year or range of years
+        is allowed
+    :years: the number of latest years to fetch again.  Defaults to
+        REFRESH_YEARS
+    :returns: a list of dictionaries, empty if there is no data for the
+        years asked for, or None if the series couldn't be fetched
+    """
+    query, first, last = range_query(query_url, args)
+    if years is None:
+        years = REFRESH_YEARS
+    key = series_key(query)
+    today = daycount()
+    info = CACHE.get_meta(key)
+    entry = CACHE.get(key)
+    if (entry is None or info is None or
+            info["full_day"] <= today - FULL_REFRESH):
+        records = fetch_query(query_url)
+        if records is None:
+            return None
+        info = {"indicator": query.rsplit("/indicators/", 1)[1],
+                "query": query, "full_day": today, "window": None,
+                "updated": len(records)}
+    elif entry[0] > today - get_ttl(query):
+        records = entry[1]
+        info = None
+    else:
+        this_year = datetime.date.today().year
+        latest = max([int(i["date"][:4]) for i in entry[1]] or [this_year])
+        start = min(latest, this_year) - years + 1
+        new = fetch_query(query_url, [("date", "{0}:{1}".format(start,
+                                                                this_year))])
+        if new is None:
+            # keep the stored series, and try again next time
+            records = entry[1]
+            info = None
+        else:
+            old = set((i["country"]["id"], i["date"], i["value"]) for i in
+                      select_years(entry[1], start, this_year))
+            records = merge_series(entry[1], new, start, this_year)
+            info["window"] = [start, this_year]
+            info["updated"] = sum(1 for i in new if (
+                i["country"]["id"], i["date"], i["value"]) not in old)
+    if info is not None:
+        info.update(refreshed=time.time(), day=today, records=len(records))
+        CACHE.put(key, today, records)
+        CACHE.set_meta(key, info)
+        METRICS.incr("series_refreshed")
+    return select_years(records, first, last)
+
+
+def refresh_info(query_url):
+    """
+    Return the metadata of the series kept by fetch_incremental for a query
+    for indicator data, or None if it has not been fetched.  This is a
+    dictionary of:
+
+        indicator, query: the indicator and the query for every year of it
+        refreshed, day: the time and day the series was last brought up to
+            date
+        full_day: the day the whole series was last downloaded
+        window: the [first, last] years fetched by the last incremental
+            refresh, or None if it was a full download
+        updated: the records added or changed by the last refresh
+        records: the records in the series
+
+    For a query split into parts, the series of the parts are described
+    together: times and days are those of the least recent part, window
+    spans the windows of every part, and updated and records are totals.
+
+    :query_url: the base url of the query
+    """
+    ranged = range_query(query_url)
+    if ranged is None:
+        return None
+    infos = []
+    for chunk in split_countries(query_url):
+        info = CACHE.get_meta(series_key(range_query(chunk)[0]))
+        if info is None:
+            return None
+        infos.append(info)
+    if len(infos) == 1:
+        return infos[0]
+    windows = [i["window"] for i in infos]
+    info = dict(infos[0], query=ranged[0],
+                updated=sum(i["updated"] for i in infos),
+                records=sum(i["records"] for i in infos))
+    for name in ("refreshed", "day", "full_day"):
+        info[name] = min(i[name] for i in infos)
+    if None in windows:
+        info["window"] = None
+    else:
+        info["window"] = [min(i[0] for i in windows),
+                          max(i[1] for i in windows)]
+    return info
+
+
+def iter_fetch(query_url, args=None, cached=True, threads=None):
+    """
+    Fetch data from the World Bank API or from cache one page at a time, so
+    that only a few pages of PER_PAGE records are held in memory at once.
+    Up to threads pages are fetched ahead of the one being consumed.  If a
+    page can't be fetched, ValueError is raised rather than the results
+    ending early.
+
+    :query_url: the base url to be queried
+    :args: a dictionary of GET arguments
+    :cached: use the cache
+    :threads: the most pages to fetch at once.  Defaults to THREADS
+    :returns: a generator of lists of dictionaries, one list per page
+    """
+    chunks = split_countries(query_url)
+    if len(chunks) > 1:
+        for chunk in chunks:
+            for page in iter_fetch(chunk, args, cached, threads):
+                yield page
+        return
+    # pages stay small, rather than sized to fetch the query at once
+    query_url = build_url(query_url, args, PER_PAGE)
+    response = fetch_page(query_url, cached)
+    if response is None:
+        raise ValueError("Got no response for {0}".format(query_url))
+    if is_empty(response):
+        return
+    page_urls = remaining_page_urls(query_url, response)
+    yield collect_results([response])
+    if not page_urls:
+        return
+    if threads is None:
+        threads = THREADS
+    threads = max(1, min(threads, len(page_urls)))
+    pool = thread_pool(threads)
+    try:
+        page_urls = iter(page_urls)
+        pending = deque()
+        for url in page_urls:
+            pending.append((url, pool.apply_async(fetch_page, (url, cached))))
+            if len(pending) == threads:
+                break
+        while pending:
+            url, result = pending.popleft()
+            response = result.get()
+            if response is None:
+                raise ValueError("Got no response for {0}".format(url))
+            for next_url in page_urls:
+                pending.append((next_url, pool.apply_async(
+                    fetch_page, (next_url, cached))))
+                break
+            yield collect_results([response])
+    finally:
+        pool.close()
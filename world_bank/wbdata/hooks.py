@@ -0,0 +1,73 @@
+"""
+wbdata.hooks: callbacks fired around each stage of retrieving data
+
+A hook is called as hook(stage, seconds, records) after each stage, where
+records is the number of records or rows the stage produced, or None.  The
+stages of get_data are "build_url", "fetch", "decode" (parsing of each page
+downloaded), "convert_dates", "convert_to_dataframe", and "set_index".
+Nothing is timed while no hook is registered.
+"""
+
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+import time
+
+HOOKS = []
+
+
+def register_hook(hook):
+    """
+    Register a hook to be called after each stage.  Returns the hook, so
+    this can be used as a decorator.
+
+    :hook: a callable taking (stage, seconds, records)
+    """
+    HOOKS.append(hook)
+    return hook
+
+
+def unregister_hook(hook):
+    """
+    Stop calling a registered hook
+
+    :hook: a hook passed to register_hook
+    """
+    HOOKS.remove(hook)
+
+
+def fire(stage, seconds, records=None):
+    """
+    Call every registered hook for a finished stage
+
+    :stage: the name of the stage
+    :seconds: how long the stage took
+    :records: the number of records or rows the stage produced, if known
+    """
+    for hook in list(HOOKS):
+        hook(stage, seconds, records)
+
+
+def timed(stage, func, *args, **kwargs):
+    """
+    Call func(*args, **kwargs) as a stage, timing it and firing the hooks
+    if any are registered.  The records reported are the length of the
+    result, or None if it is a tuple of several values.
+
+    :stage: the name of the stage
+    :func: the function to call
+    :returns: the result of func
+    """
+    if not HOOKS:
+        return func(*args, **kwargs)
+    started = time.time()
+    result = func(*args, **kwargs)
+    seconds = time.time() - started
+    records = None
+    if not isinstance(result, tuple):
+        try:
+            records = len(result)
+        except TypeError:
+            pass
+    fire(stage, seconds, records)
+    return result
@@ -0,0 +1,111 @@
+"""
+wbdata.metrics: counters and histograms describing fetch performance
+"""
+
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+import bisect
+import json
+import threading
+import time
+
+BOUNDS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
+
+
+class Histogram(object):
+    """
+    A distribution of observed values, kept as count, sum, extremes and
+    counts per bucket
+    """
+
+    def __init__(self, bounds=BOUNDS):
+        """
+        :bounds: the ascending upper bounds of the buckets; larger values
+            are counted in a final unbounded bucket
+        """
+        self.bounds = tuple(bounds)
+        self.buckets = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        """Record a value"""
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def summary(self):
+        """Return the histogram as a dictionary"""
+        bounds = list(self.bounds) + ["+Inf"]
+        return {"count": self.count,
+                "sum": self.total,
+                "min": self.min,
+                "max": self.max,
+                "mean": self.total / self.count if self.count else None,
+                "buckets": [[bound, count] for bound, count in
+                            zip(bounds, self.buckets)]}
+
+
+class Metrics(object):
+    """
+    A thread-safe set of named counters and histograms
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__counters = {}
+        self.__histograms = {}
+
+    def incr(self, name, value=1):
+        """Add value to the counter name"""
+        with self.__lock:
+            self.__counters[name] = self.__counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        """Record value in the histogram name"""
+        with self.__lock:
+            if name not in self.__histograms:
+                self.__histograms[name] = Histogram()
+            self.__histograms[name].observe(value)
+
+    def snapshot(self):
+        """
+        Return the current values as a dictionary with "counters" mapping
+        names to values and "histograms" mapping names to summaries
+        """
+        with self.__lock:
+            return {"counters": dict(self.__counters),
+                    "histograms": dict((name, h.summary()) for name, h in
+                                       self.__histograms.items())}
+
+    def reset(self):
+        """Clear all counters and histograms"""
+        with self.__lock:
+            self.__counters = {}
+            self.__histograms = {}
+
+    def dump(self, fileobj):
+        """
+        Write the current values to fileobj as JSON lines, one per counter
+        or histogram
+
+        :fileobj: a file-like object opened for writing text
+        """
+        now = time.time()
+        snapshot = self.snapshot()
+        for name, value in sorted(snapshot["counters"].items()):
+            fileobj.write(json.dumps({"time": now, "type": "counter",
+                                      "name": name, "value": value}))
+            fileobj.write("\n")
+        for name, summary in sorted(snapshot["histograms"].items()):
+            record = {"time": now, "type": "histogram", "name": name}
+            record.update(summary)
+            fileobj.write(json.dumps(record))
+            fileobj.write("\n")
@@ -0,0 +1,206 @@
+"""
+wbdata.prefetch: warm the cache for a planned set of queries
+
+A manifest is a JSON object with any of the following keys:
+
+    indicators: a list of indicator codes
+    topics: a list of topic ids, or "all", whose indicators are added to
+        indicators
+    countries: a list of country codes, sequences of country codes or "all".
+        Defaults to ["all"]
+    dates: a list of dates, each a year, a [start, end] pair of years, or
+        null for all dates.  Defaults to [null]
+    years: a [start, end] pair of years, such as scrape.py queries one at
+        a time; each year is added to dates.  Dates whose years overlap or
+        adjoin are fetched as one query for all their years, as the cache
+        answers a query for any of those years from it
+    metadata: if true, also fetch the lists of countries, topics, and
+        indicators, and the indicators of each topic
+
+Usage: python -m wbdata prefetch [-t <threads>] [-q] <manifest>
+"""
+
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+import datetime
+import getopt
+import json
+import sys
+
+from . import api, fetcher
+
+
+def parse_date(date):
+    """
+    Return a manifest date as get_data expects it
+
+    :date: a year, a [start, end] pair of years, or None
+    """
+    if date is None:
+        return None
+    if isinstance(date, (list, tuple)):
+        return tuple(datetime.datetime(int(i), 1, 1) for i in date)
+    return datetime.datetime(int(date), 1, 1)
+
+
+def date_years(date):
+    """
+    Return the (first, last) years of a date as parse_date returns it
+
+    :date: a datetime, a (start, end) pair of datetimes, or None for all
+        years
+    """
+    if date is None:
+        return fetcher.ALL_YEARS
+    if isinstance(date, tuple):
+        return date[0].year, date[1].year
+    return date.year, date.year
+
+
+def merge_dates(dates):
+    """
+    Return the fewest dates that cover every date listed, merging dates
+    whose years overlap or adjoin into one span of years.  The range-aware
+    cache answers a query for any of those years once the span has been
+    fetched.
+
+    :dates: a list of dates as parse_date returns them
+    """
+    spans = []
+    for first, last in sorted(date_years(i) for i in dates):
+        if spans and first <= spans[-1][1] + 1:
+            spans[-1][1] = max(spans[-1][1], last)
+        else:
+            spans.append([first, last])
+    merged = []
+    for first, last in spans:
+        if (first, last) == fetcher.ALL_YEARS:
+            merged.append(None)
+        elif first == last:
+            merged.append(parse_date(first))
+        else:
+            merged.append(parse_date([first, last]))
+    return merged
+
+
+def plan(manifest):
+    """
+    Return the queries needed to warm the cache for a manifest, without
+    duplicates, and with one query for each span of consecutive years
+
+    :manifest: a dictionary as described in the module docstring
+    :returns: a list of (query_url, args) tuples to pass to fetcher.fetch
+    """
+    queries = []
+    seen = set()
+
+    def add(query_url, args=None):
+        args = tuple(args or ())
+        if (query_url, args) not in seen:
+            seen.add((query_url, args))
+            queries.append((query_url, list(args)))
+
+    topics = manifest.get("topics") or []
+    if topics == "all" or manifest.get("metadata"):
+        add(api.TOPIC_URL)
+    if manifest.get("metadata"):
+        add(api.COUNTRIES_URL)
+        add(api.INDICATOR_URL)
+        topics = topics or "all"
+    if topics == "all":
+        topics = [i["id"] for i in fetcher.fetch(api.TOPIC_URL) or []]
+    indicators = list(manifest.get("indicators") or [])
+    for topic in topics:
+        query_url = api.indicator_query_url(topic=topic)
+        add(query_url)
+        if manifest.get("topics"):
+            indicators.extend(i["id"] for i in
+                              fetcher.fetch(query_url) or [])
+    dates = [parse_date(i) for i in manifest.get("dates") or []]
+    if manifest.get("years"):
+        start, end = manifest["years"]
+        dates.extend(parse_date(i) for i in range(int(start), int(end) + 1))
+    if not dates and "dates" not in manifest:
+        dates = [None]
+    dates = merge_dates(dates)
+    for indicator in indicators:
+        for country in manifest.get("countries") or ["all"]:
+            for data_date in dates:
+                add(*api.data_query(indicator, country, data_date))
+    return queries
+
+
+def prefetch(manifest, threads=None, progress=None):
+    """
+    Fetch every query planned for a manifest into the cache
+
+    :manifest: a dictionary as described in the module docstring
+    :threads: the most queries to fetch at once.  Defaults to
+        fetcher.THREADS
+    :progress: if given, called as progress(done, total, url) after each
+        query, with the full url of its first page
+    :returns: a list of the (query_url, args) tuples that returned no data
+    """
+    queries = plan(manifest)
+    if threads is None:
+        threads = fetcher.THREADS
+    empty = []
+    if not queries:
+        return empty
+    pool = fetcher.thread_pool(max(1, min(threads, len(queries))))
+    try:
+        results = pool.imap_unordered(
+            lambda query: (query, fetcher.fetch(*query)), queries)
+        for done, (query, data) in enumerate(results, 1):
+            if data is None:
+                empty.append(query)
+            if progress is not None:
+                progress(done, len(queries), fetcher.build_url(*query))
+    finally:
+        pool.close()
+    return empty
+
+
+def print_progress(done, total, url):
+    """Report prefetch progress on stderr"""
+    print("[{0}/{1}] {2}".format(done, total, url), file=sys.stderr)
+
+
+def main(argv=None):
+    """
+    Run a prefetch from the command line
+
+    :argv: command line arguments, not including the program name
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    try:
+        opts, args = getopt.getopt(argv, "t:qh", ["threads=", "quiet",
+                                                  "help"])
+    except getopt.GetoptError as err:
+        print(err, file=sys.stderr)
+        return 2
+    threads = None
+    progress = print_progress
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            print(__doc__)
+            return 0
+        elif o in ("-t", "--threads"):
+            threads = int(a)
+        elif o in ("-q", "--quiet"):
+            progress = None
+    if len(args) != 1:
+        print("Usage: python -m wbdata prefetch [-t <threads>] [-q] "
+              "<manifest>", file=sys.stderr)
+        return 2
+    with open(args[0]) as manifest_file:
+        manifest = json.load(manifest_file)
+    empty = prefetch(manifest, threads, progress)
+    print("{0} queries returned no data".format(len(empty)), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""
+wbdata.ratelimit: token buckets limiting the rate of API requests
+"""
+
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+import os
+import sqlite3
+import threading
+import time
+
+from .cache import get_cachedir
+
+clock = getattr(time, "monotonic", time.time)
+
+
+class TokenBucket(object):
+    """
+    A token bucket shared by the threads of a process.  Tokens accrue at
+    rate per second up to burst; each request takes one, waiting for it if
+    the bucket is empty.
+    """
+
+    def __init__(self, rate, burst=None):
+        """
+        :rate: the sustained requests per second
+        :burst: the most requests that can be made at once after a quiet
+            spell.  Defaults to rate, or 1 if rate is lower
+        """
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.burst = float(burst or max(1, rate))
+        self.__tokens = self.burst
+        self.__updated = clock()
+        self.__lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take a token, sleeping until one is available
+
+        :returns: the seconds spent waiting
+        """
+        with self.__lock:
+            now = clock()
+            self.__tokens = min(self.burst, self.__tokens +
+                                (now - self.__updated) * self.rate)
+            self.__updated = now
+            # take the token now, even if that leaves the bucket in debt,
+            # so that waiters are served in the order they arrived
+            self.__tokens -= 1
+            wait = max(0, -self.__tokens / self.rate)
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+class SharedTokenBucket(object):
+    """
+    A token bucket shared by every process on the host that uses the same
+    file, kept in a SQLite database
+    """
+
+    def __init__(self, rate, burst=None, path=None):
+        """
+        :rate: the sustained requests per second
+        :burst: the most requests that can be made at once after a quiet
+            spell.  Defaults to rate, or 1 if rate is lower
+        :path: the database file holding the bucket.  Defaults to
+            "ratelimit.sqlite" in the wbdata cache directory
+        """
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.burst = float(burst or max(1, rate))
+        if path is None:
+            path = os.path.join(get_cachedir(), "ratelimit.sqlite")
+        self.path = path
+        self.__conn = None
+        self.__lock = threading.Lock()
+
+    @property
+    def conn(self):
+        if self.__conn is None:
+            cachedir = os.path.dirname(self.path)
+            if cachedir and not os.path.exists(cachedir):
+                os.makedirs(cachedir)
+            conn = sqlite3.connect(self.path, timeout=60,
+                                   isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("CREATE TABLE IF NOT EXISTS bucket ("
+                         "name TEXT PRIMARY KEY, "
+                         "tokens REAL NOT NULL, "
+                         "updated REAL NOT NULL)")
+            self.__conn = conn
+        return self.__conn
+
+    def acquire(self):
+        """
+        Take a token, sleeping until one is available
+
+        :returns: the seconds spent waiting
+        """
+        with self.__lock:
+            conn = self.conn
+            # an immediate transaction takes the write lock up front, so
+            # that processes take turns updating the bucket
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = conn.execute("SELECT tokens, updated FROM bucket "
+                                   "WHERE name = 'default'").fetchone()
+                if row is None:
+                    tokens = self.burst
+                else:
+                    tokens = min(self.burst,
+                                 row[0] + max(0, now - row[1]) * self.rate)
+                tokens -= 1
+                conn.execute("INSERT OR REPLACE INTO bucket "
+                             "(name, tokens, updated) "
+                             "VALUES ('default', ?, ?)", (tokens, now))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        wait = max(0, -tokens / self.rate)
+        if wait:
+            time.sleep(wait)
+        return wait
@@ -0,0 +1,4 @@
+"""
+wbdata.tests: checks of wbdata, with fetches made against a local
+stand-in for the API
+"""
@@ -0,0 +1,93 @@
+"""
+wbdata.tests.bench_cache: disk footprint and warm-read time of cache
+entries for each COMPRESSION and DECODED setting
+
+Run from world_bank with python -m wbdata.tests.bench_cache [pages].
+Each setting stores that many copies (200 by default) of a 1000-record
+indicator page in a new cache, then reads them all back through
+Cache.get.  Disk use is the size of the database file per page.
+"""
+
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import timeit
+
+from .. import cache
+
+REPEATS = 3
+
+
+def make_page(records=1000, seed=1):
+    """Return a decoded page of indicator data, as the API sends it"""
+    rng = random.Random(seed)
+    data = [{"indicator": {"id": "NY.GDP.MKTP.CD",
+                           "value": "GDP (current US$)"},
+             "country": {"id": "C{0:02d}".format(i // 50),
+                         "value": "Country {0:02d}".format(i // 50)},
+             "countryiso3code": "C{0:02d}".format(i // 50),
+             "date": str(2019 - i % 50),
+             "value": (None if rng.random() < 0.2 else
+                       round(rng.random() * 1e12, 1)),
+             "unit": "", "obs_status": "", "decimal": 1}
+            for i in range(records)]
+    head = {"page": 1, "pages": 1, "per_page": records, "total": records,
+            "sourceid": "2", "lastupdated": "2019-12-20"}
+    return [head, data]
+
+
+def measure(page, pages, compression, decoded):
+    """
+    Return the bytes on disk and the seconds of a warm read per page for a
+    cache storing pages copies of page
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, "cache.sqlite")
+        store = cache.Cache(path, compression=compression, decoded=decoded,
+                            max_size=0)
+        for i in range(pages):
+            store.put("page{0}".format(i), 1, page)
+        store.close()
+        size = os.path.getsize(path)
+        store = cache.Cache(path)
+        keys = ["page{0}".format(i) for i in range(pages)]
+        best = None
+        for _ in range(REPEATS):
+            started = timeit.default_timer()
+            for key in keys:
+                store.get(key)
+            seconds = timeit.default_timer() - started
+            if best is None or seconds < best:
+                best = seconds
+        store.close()
+    finally:
+        shutil.rmtree(tmpdir)
+    return size / pages, best / pages
+
+
+def main(pages=200):
+    page = make_page()
+    print("{0} pages of {1} records, best of {2} reads".format(
+        pages, len(page[1]), REPEATS))
+    print("{0:<15}  {1:>10}  {2:>11}".format("storage", "disk/page",
+                                              "read/page"))
+    for decoded in (False, True):
+        for compression in ("none", "zlib", "lzma"):
+            if compression not in cache.CODECS:
+                continue
+            size, seconds = measure(page, pages, compression, decoded)
+            default = (compression == cache.COMPRESSION and
+                       decoded == cache.DECODED)
+            print("{0:<6} + {1:<6}  {2:7.1f} KB  {3:8.2f} ms{4}".format(
+                compression, "pickle" if decoded else "json", size / 1024,
+                seconds * 1000, "   (default)" if default else ""))
+
+
+if __name__ == "__main__":
+    main(*[int(i) for i in sys.argv[1:2]])
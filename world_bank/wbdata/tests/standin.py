@@ -0,0 +1,168 @@
+"""
+wbdata.tests.standin: a local stand-in for the World Bank API that can
+inject faults
+
+The server answers indicator queries like the API, with one record per
+country and year asked for, or per country and each of the most recent
+mrv years, paged as requested.  Codes of countries starting with "X" and
+the indicator "EMPTY" have no data; no value is missing, so gapfill
+changes nothing.  Each response carries an ETag, and a request with a
+matching If-None-Match gets 304 Not Modified.
+
+Requests whose path contains any of the strings in broken are answered
+404.  Faults queued on the server are used up one per request, in order:
+
+    "500", "503", "429", "404": answer with that status
+    "reset": close the connection without answering
+    "timeout": answer only after delay seconds
+    "redirect": answer 301, moving the url to the server at redirect_to,
+        or to the same url if that is None
+
+The stand-in also serves requests by absolute url, as a proxy would.
+"""
+
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+import json
+import threading
+import time
+import zlib
+
+try:  # python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlsplit
+except ImportError:  # python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlsplit
+
+COUNTRIES = ["AR", "BR", "CL"]
+YEARS = (2000, 2005)
+
+
+def records(path, query):
+    """
+    Return the records the stand-in holds for a query, latest years first
+    for each country
+
+    :path: the path of the request
+    :query: the GET arguments of the request, as parse_qs returns them
+    """
+    segments = path.strip("/").split("/")
+    indicator = segments[-1]
+    codes = COUNTRIES
+    if "countries" in segments:
+        named = segments[segments.index("countries") + 1]
+        if named.lower() != "all":
+            codes = named.split(";")
+    first, last = YEARS
+    if "date" in query:
+        dates = query["date"][0].split(":")
+        first, last = int(dates[0]), int(dates[-1])
+    if "mrv" in query:
+        first = max(first, last - int(query["mrv"][0]) + 1)
+    if indicator == "EMPTY":
+        return []
+    return [{"indicator": {"id": indicator, "value": indicator},
+             "country": {"id": code, "value": "Country " + code},
+             "value": "{0}.5".format(year), "decimal": "1",
+             "date": str(year)}
+            for code in codes if not code.startswith("X")
+            for year in range(last, first - 1, -1)]
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(self.path)
+            server.headers.append(dict((k.lower(), v) for k, v in
+                                       self.headers.items()))
+            fault = server.faults.pop(0) if server.faults else None
+            if any(i in self.path for i in server.broken):
+                fault = "404"
+        if fault == "reset":
+            self.close_connection = True
+            return
+        if fault == "timeout":
+            time.sleep(server.delay)
+        if fault in ("500", "503", "429", "404"):
+            self.answer(int(fault), b"")
+            return
+        parts = urlsplit(self.path)
+        if fault == "redirect":
+            location = self.path
+            if server.redirect_to is not None:
+                location = server.redirect_to + parts.path
+                if parts.query:
+                    location = "?".join((location, parts.query))
+            self.answer(301, b"", {"Location": location})
+            return
+        query = parse_qs(parts.query)
+        found = records(parts.path, query)
+        per_page = int(query.get("per_page", ["50"])[0])
+        page = int(query.get("page", ["1"])[0])
+        pages = -(-len(found) // per_page)
+        head = {"page": page, "pages": pages, "per_page": per_page,
+                "total": len(found)}
+        found = found[(page - 1) * per_page:page * per_page] or None
+        body = json.dumps([head, found]).encode("ascii")
+        etag = '"{0:x}"'.format(zlib.crc32(body) & 0xffffffff)
+        if self.headers.get("If-None-Match") == etag:
+            self.answer(304, b"", {"ETag": etag})
+            return
+        self.answer(200, body, {"ETag": etag})
+
+    def answer(self, status, body, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StandIn(ThreadingMixIn, HTTPServer):
+    """
+    The stand-in server, listening on a free local port in a background
+    thread once started.  requests lists the paths requested so far, and
+    headers the headers of each request, with lowercase names.
+    """
+
+    daemon_threads = True
+    block_on_close = False
+
+    def __init__(self, delay=1):
+        """
+        :delay: the seconds a "timeout" fault delays its answer
+        """
+        HTTPServer.__init__(self, ("127.0.0.1", 0), Handler)
+        self.delay = delay
+        self.faults = []
+        self.requests = []
+        self.headers = []
+        self.redirect_to = None
+        self.broken = set()
+        self.lock = threading.Lock()
+        self.url = "http://127.0.0.1:{0}".format(self.server_address[1])
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, args=(0.05,))
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def handle_error(self, request, client_address):
+        # clients that time out leave broken pipes behind
+        pass
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
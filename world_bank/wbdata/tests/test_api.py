@@ -0,0 +1,202 @@
+"""
+wbdata.tests.test_api: get_data's mrv and gapfill, and converting records
+to its Series and combining them into get_dataframe's DataFrames with
+pandas
+"""
+
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+import datetime
+import random
+import unittest
+
+try:  # python 2
+    from urlparse import parse_qs, urlsplit
+except ImportError:  # python 3
+    from urllib.parse import parse_qs, urlsplit
+
+from .. import api
+from .test_fetcher import StandInTest
+
+pd = api.load_pandas()
+
+
+def records(countries, years, value=None):
+    """
+    Return records as the API sends them, latest years first for each
+    country
+
+    :countries: the numbers of the countries
+    :years: the years
+    :value: a function of the country and year giving the value; by default
+        a number unique to both
+    """
+    if value is None:
+        value = lambda country, year: country * 100.0 + year % 100
+    return [{"country": {"value": "Country {0}".format(country)},
+             "date": str(year), "value": value(country, year)}
+            for country in countries for year in sorted(years, reverse=True)]
+
+
+def series(data, convert_date=False, keep_levels=True):
+    """Return the Series get_data would make of records"""
+    return api.format_data(data, convert_date, True, "value", keep_levels)
+
+
+@unittest.skipIf(not pd, "needs pandas")
+class ConvertTest(unittest.TestCase):
+
+    VALUES = [None, "", "abc", " 2 ", "1e3", "-3", 5, 7.5]
+
+    def values(self, data):
+        return list(api.convert_to_dataframe(data, "value")["value"])
+
+    def expected(self, data):
+        # as cast_float converted them, with NaN for None
+        values = [api.cast_float(i["value"]) for i in data]
+        return [float("nan") if i is None else i for i in values]
+
+    def assertValues(self, values):
+        data = [{"country": {"value": "Country 1"}, "date": "2000",
+                 "value": i} for i in values]
+        # NaN is not equal to itself, so compare the values as strings
+        self.assertEqual([repr(i) for i in self.values(data)],
+                         [repr(i) for i in self.expected(data)])
+
+    def test_values_are_cast_as_cast_float_did(self):
+        self.assertValues(self.VALUES)
+
+    def test_numeric_values_are_cast_as_cast_float_did(self):
+        self.assertValues([i for i in self.VALUES if i not in ("", "abc")])
+
+    def test_countries_are_sorted_categories(self):
+        data = records([3, 1, 12, 2], [2000, 2001])
+        countries = api.convert_to_dataframe(data, "value")["country"]
+        self.assertEqual(list(countries.cat.categories),
+                         ["Country 1", "Country 12", "Country 2",
+                          "Country 3"])
+        self.assertEqual(list(countries),
+                         [i["country"]["value"] for i in data])
+
+
+@unittest.skipIf(not pd, "needs pandas")
+class CombineTest(unittest.TestCase):
+    """
+    combine_series gives the same DataFrame as pd.DataFrame(dict) would,
+    apart from keeping the country level categorical
+    """
+
+    def assertCombined(self, to_df):
+        expected = pd.DataFrame(to_df)
+        result = api.combine_series(to_df)
+        pd.testing.assert_frame_equal(result, expected,
+                                      check_index_type=False,
+                                      check_categorical=False)
+        return result
+
+    def test_identical_indexes(self):
+        result = self.assertCombined({
+            "a": series(records([3, 1, 2], [2000, 2001])),
+            "b": series(records([3, 1, 2], [2000, 2001], lambda c, y: c - y))})
+        self.assertEqual(len(result), 6)
+
+    def test_differing_levels(self):
+        self.assertCombined({"a": series(records([3, 1], [2000, 2001])),
+                             "b": series(records([2, 4, 1], [2001, 2002])),
+                             "c": series(records([5], [1999, 2003]))})
+
+    def test_differing_converted_dates(self):
+        self.assertCombined({
+            "a": series(records([1, 2], [2000, 2001]), convert_date=True),
+            "b": series(records([2, 3], [2001, 2002]), convert_date=True)})
+
+    def test_single_level_indexes(self):
+        result = self.assertCombined({
+            "a": series(records([1], [2000, 2001]), keep_levels=False),
+            "b": series(records([1], [2001, 2003]), keep_levels=False)})
+        self.assertEqual(result.index.nlevels, 1)
+
+    def test_mixed_levels_are_left_to_pandas(self):
+        result = self.assertCombined({
+            "a": series(records([1], [2000, 2001]), keep_levels=False),
+            "b": series(records([1, 2], [2000, 2001]))})
+        self.assertEqual(len(result), 6)
+
+    def test_country_level_stays_categorical(self):
+        result = self.assertCombined({"a": series(records([3, 1], [2000])),
+                                      "b": series(records([2, 1], [2000]))})
+        countries = result.index.levels[0]
+        self.assertIsInstance(countries, pd.CategoricalIndex)
+        self.assertEqual(list(countries.categories),
+                         ["Country 1", "Country 2", "Country 3"])
+
+    def test_random_series(self):
+        rng = random.Random(24)
+        for _ in range(100):
+            convert_date = rng.random() < 0.5
+            keep_levels = rng.random() < 0.8
+            to_df = {}
+            for name in "abc"[:rng.randint(1, 3)]:
+                countries = rng.sample(range(12), rng.randint(1, 8))
+                years = rng.sample(range(2000, 2012), rng.randint(1, 6))
+                data = [i for i in records(countries, years, lambda c, y:
+                                           rng.random() if rng.random() > 0.1
+                                           else None)
+                        if rng.random() > 0.2] or records([0], [2000])
+                to_df[name] = series(data, convert_date, keep_levels)
+            if len(set(i.index.nlevels for i in to_df.values())) > 1:
+                # mixed index levels are left to pandas, which can't always
+                # align them either
+                continue
+            result = self.assertCombined(to_df)
+            if result.index.nlevels == 2:
+                self.assertIsInstance(result.index.levels[0],
+                                      pd.CategoricalIndex)
+
+
+class MrvTest(StandInTest):
+    """get_data's mrv and gapfill, against the stand-in server"""
+
+    def setUp(self):
+        StandInTest.setUp(self)
+        self.countries_url = api.COUNTRIES_URL
+        api.COUNTRIES_URL = self.server.url + "/countries"
+
+    def tearDown(self):
+        api.COUNTRIES_URL = self.countries_url
+        StandInTest.tearDown(self)
+
+    def test_mrv_and_date_are_exclusive(self):
+        self.assertRaises(ValueError, api.get_data, "SP.POP.TOTL",
+                          data_date=datetime.datetime(2001, 1, 1), mrv=2)
+        self.assertEqual(self.server.requests, [])
+
+    def test_gapfill_needs_mrv(self):
+        self.assertRaises(ValueError, api.get_data, "SP.POP.TOTL",
+                          gapfill=True)
+        self.assertEqual(self.server.requests, [])
+
+    def test_most_recent_values_are_requested(self):
+        results = api.get_data("SP.POP.TOTL", country=["AR", "BR"], mrv=2,
+                               gapfill=True)
+        query = parse_qs(urlsplit(self.server.requests[0]).query)
+        self.assertEqual(query["mrv"], ["2"])
+        self.assertEqual(query["gapfill"], ["Y"])
+        self.assertEqual(sorted((i["country"]["id"], i["date"])
+                                for i in results),
+                         [("AR", "2004"), ("AR", "2005"), ("BR", "2004"),
+                          ("BR", "2005")])
+
+    @unittest.skipIf(not pd, "needs pandas")
+    def test_latest_value_is_indexed_by_country(self):
+        result = api.get_data("SP.POP.TOTL", mrv=1, pandas=True)
+        self.assertEqual(result.index.nlevels, 1)
+        self.assertEqual(result.index.name, "country")
+        self.assertEqual(list(result.index),
+                         ["Country AR", "Country BR", "Country CL"])
+        self.assertEqual(list(result), [2005.5] * 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,202 @@
+"""
+wbdata.tests.test_cache: checksums, salvage of damaged files, concurrent
+writers, pickle migration and LRU eviction of the cache
+"""
+
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+import json
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+try:  # python 2
+    import cPickle as pickle
+except ImportError:  # python 3
+    import pickle
+
+from .. import cache
+from ..cache import Cache
+
+WRITER = """
+import sys
+from wbdata.cache import Cache
+path, prefix, count = sys.argv[1], sys.argv[2], int(sys.argv[3])
+store = Cache(path)
+for i in range(count):
+    store.put("{0}{1}".format(prefix, i), 1, [{"page": 1}, [prefix, i]])
+store.close()
+"""
+
+
+def has_dbstat():
+    conn = sqlite3.connect(":memory:")
+    try:
+        conn.execute("SELECT 1 FROM dbstat").fetchall()
+        return True
+    except sqlite3.Error:
+        return False
+    finally:
+        conn.close()
+
+
+class CacheTest(unittest.TestCase):
+    """Run each test against a cache in a new temporary directory"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "cache.sqlite")
+        self.cache = Cache(self.path)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.tmpdir)
+
+    def response(self, i, size=40):
+        text = "".join(random.Random(i).choice("abcdefghij")
+                       for _ in range(size))
+        return [{"page": 1, "pages": 1, "total": 1},
+                [{"id": i, "value": text}]]
+
+    def fill(self, count, size=40):
+        for i in range(count):
+            self.cache.put("url{0}".format(i), 1, self.response(i, size))
+        self.cache.close()
+
+    def writer(self, prefix, count):
+        """Start a process writing count entries to the cache"""
+        env = dict(os.environ)
+        package_dir = os.path.dirname(os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__))))
+        env["PYTHONPATH"] = os.pathsep.join(
+            [package_dir] + [i for i in [env.get("PYTHONPATH")] if i])
+        return subprocess.Popen([sys.executable, "-c", WRITER, self.path,
+                                 prefix, str(count)], env=env)
+
+
+class ChecksumTest(CacheTest):
+
+    def test_tampered_response_is_discarded(self):
+        # stored as plain JSON, the tampered entry still decodes, so only
+        # its checksum can tell
+        self.cache = Cache(self.path, compression="none", decoded=False)
+        self.fill(2)
+        conn = sqlite3.connect(self.path)
+        data = bytes(conn.execute("SELECT response FROM cache "
+                                  "WHERE url = 'url0'").fetchone()[0])
+        conn.execute("UPDATE cache SET response = ? WHERE url = 'url0'",
+                     (sqlite3.Binary(data.replace(b'"id": 0', b'"id": 9')),))
+        conn.commit()
+        conn.close()
+        self.assertIsNone(self.cache.get("url0"))
+        self.assertNotIn("url0", self.cache)
+        self.assertEqual(self.cache.get("url1"), (1, self.response(1)))
+
+
+class SalvageTest(CacheTest):
+
+    def test_garbage_header_is_rebuilt(self):
+        self.fill(10)
+        with open(self.path, "r+b") as dbfile:
+            dbfile.write(b"\xde\xad\xbe\xef" * 32)
+        self.assertIsNone(self.cache.get("url0"))
+        self.cache.put("fresh", 2, self.response(0))
+        self.assertEqual(self.cache.get("fresh"), (2, self.response(0)))
+        self.assertFalse(os.path.exists(self.path + ".broken"))
+
+    @unittest.skipIf(not has_dbstat(), "needs the dbstat table")
+    def test_damaged_page_loses_only_its_rows(self):
+        self.fill(400, size=200)
+        conn = sqlite3.connect(self.path)
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        pages = conn.execute("SELECT pageno, ncell FROM dbstat WHERE "
+                             "name = 'cache' AND pagetype = 'leaf' "
+                             "ORDER BY pageno").fetchall()
+        conn.close()
+        pageno, ncell = pages[len(pages) // 2]
+        with open(self.path, "r+b") as dbfile:
+            dbfile.seek((pageno - 1) * page_size)
+            dbfile.write(os.urandom(page_size))
+        self.cache.recover()
+        self.assertEqual(len(self.cache), 400 - ncell)
+        for i in range(400):
+            entry = self.cache.get("url{0}".format(i))
+            if entry is not None:
+                self.assertEqual(entry, (1, self.response(i, 200)))
+
+
+class ConcurrencyTest(CacheTest):
+
+    def test_concurrent_writers_both_succeed(self):
+        self.fill(1)
+        writers = [self.writer(prefix, 200) for prefix in ("a", "b")]
+        self.assertEqual([i.wait() for i in writers], [0, 0])
+        self.assertEqual(len(self.cache), 401)
+
+    def test_busy_database_is_waited_for(self):
+        self.fill(10)
+        conn = sqlite3.connect(self.path, isolation_level=None)
+        conn.execute("BEGIN IMMEDIATE")
+        writer = self.writer("a", 1)
+        time.sleep(0.5)
+        conn.execute("COMMIT")
+        conn.close()
+        self.assertEqual(writer.wait(), 0)
+        # a busy database is not mistaken for a damaged one
+        self.assertEqual(len(self.cache), 11)
+
+    def test_busy_is_not_corruption(self):
+        self.assertFalse(cache.is_corruption(
+            sqlite3.OperationalError("database is locked")))
+        self.assertTrue(cache.is_corruption(
+            sqlite3.DatabaseError("database disk image is malformed")))
+
+
+class MigrationTest(CacheTest):
+
+    def test_pickle_cache_is_migrated(self):
+        old = {"url0": (5, json.dumps(self.response(0))),
+               "url1": (6, json.dumps(self.response(1))),
+               "broken": (7, "not json")}
+        with open(self.cache.legacy_path, "wb") as cachefile:
+            pickle.dump(old, cachefile, 2)
+        self.assertEqual(self.cache.get("url0"), (5, self.response(0)))
+        self.assertEqual(self.cache["url1"], (6, self.response(1)))
+        self.assertNotIn("broken", self.cache)
+        self.assertFalse(os.path.exists(self.cache.legacy_path))
+
+    def test_missing_pickle_imports_nothing(self):
+        self.assertEqual(self.cache.migrate_pickle(self.cache.legacy_path), 0)
+
+
+class EvictionTest(CacheTest):
+
+    def test_least_recently_used_entries_are_evicted(self):
+        self.cache = Cache(self.path, compression="none", decoded=False)
+        self.cache.put("probe", 1, self.response(0))
+        size = self.cache.size
+        self.cache.clear()
+        self.cache.max_size = 10 * size + size // 2
+        for i in range(10):
+            self.cache.put("url{0}".format(i), 1, self.response(0))
+            time.sleep(0.002)
+        self.assertIsNotNone(self.cache.get("url0"))
+        time.sleep(0.002)
+        self.cache.put("url10", 1, self.response(0))
+        self.assertLessEqual(self.cache.size, self.cache.max_size * 9 // 10)
+        self.assertEqual(len(self.cache), 9)
+        self.assertNotIn("url1", self.cache)
+        self.assertNotIn("url2", self.cache)
+        self.assertIn("url0", self.cache)
+        self.assertIn("url10", self.cache)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,317 @@
+"""
+wbdata.tests.test_fetcher: retries, backoff, the circuit breaker,
+redirects, proxies, cache revalidation, the range-aware cache and split
+queries of fetcher, against the stand-in server
+
+Run with python -m unittest discover -s world_bank -t .
+"""
+
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+import warnings
+
+from .. import fetcher
+from ..cache import Cache
+from . import standin
+from .standin import StandIn
+
+
+class StandInTest(unittest.TestCase):
+    """
+    Run each test against a fresh stand-in server and an empty cache, with
+    short backoffs and timeouts
+    """
+
+    PATCHED = ("CACHE", "POOL", "BREAKER", "BACKOFF", "EXP")
+    PROXY_VARIABLES = ("http_proxy", "https_proxy", "no_proxy", "HTTP_PROXY",
+                       "HTTPS_PROXY", "NO_PROXY")
+
+    def setUp(self):
+        self.environ = dict((name, os.environ.pop(name)) for name in
+                            self.PROXY_VARIABLES if name in os.environ)
+        self.saved = dict((name, getattr(fetcher, name))
+                          for name in self.PATCHED)
+        self.tmpdir = tempfile.mkdtemp()
+        fetcher.CACHE = Cache(os.path.join(self.tmpdir, "cache.sqlite"))
+        fetcher.POOL = fetcher.ConnectionPool(timeout=0.5)
+        fetcher.BREAKER = fetcher.CircuitBreaker()
+        fetcher.BACKOFF = 0.01
+        fetcher.reset_metrics()
+        self.server = StandIn().start()
+        warnings.simplefilter("ignore")
+
+    def tearDown(self):
+        warnings.resetwarnings()
+        fetcher.POOL.clear()
+        self.server.stop()
+        fetcher.CACHE.close()
+        for name, value in self.saved.items():
+            setattr(fetcher, name, value)
+        shutil.rmtree(self.tmpdir)
+        for name in self.PROXY_VARIABLES:
+            os.environ.pop(name, None)
+        os.environ.update(self.environ)
+
+    def data_url(self, countries="all", indicator="NY.GDP.MKTP.CD"):
+        return "{0}/countries/{1}/indicators/{2}".format(self.server.url,
+                                                         countries, indicator)
+
+    def counter(self, name):
+        return fetcher.get_metrics()["counters"].get(name, 0)
+
+
+class RetryTest(StandInTest):
+
+    def test_server_errors_are_retried(self):
+        self.server.faults = ["503", "500", "429"]
+        self.assertIsNotNone(fetcher.fetch_url(self.data_url()))
+        self.assertEqual(len(self.server.requests), 4)
+        self.assertEqual(self.counter("retries"), 3)
+
+    def test_timeouts_are_retried(self):
+        self.server.faults = ["timeout"]
+        self.assertIsNotNone(fetcher.fetch_url(self.data_url()))
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.counter("request_errors"), 1)
+
+    def test_dropped_connections_are_retried(self):
+        self.server.faults = ["reset", "reset"]
+        self.assertIsNotNone(fetcher.fetch_url(self.data_url()))
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(self.counter("request_errors"), 2)
+
+    def test_client_errors_are_not_retried(self):
+        self.server.faults = ["404"]
+        self.assertIsNone(fetcher.fetch_url(self.data_url()))
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(self.counter("fetch_failures"), 1)
+
+    def test_gives_up_after_tries(self):
+        fetcher.BREAKER = fetcher.CircuitBreaker(threshold=fetcher.TRIES + 1)
+        self.server.faults = ["503"] * fetcher.TRIES
+        self.assertIsNone(fetcher.fetch_url(self.data_url()))
+        self.assertEqual(len(self.server.requests), fetcher.TRIES)
+        self.assertIsNotNone(fetcher.fetch_url(self.data_url()))
+
+    def test_failed_page_fails_fetch(self):
+        self.server.faults = ["404"]
+        self.assertIsNone(fetcher.fetch(self.data_url()))
+        self.assertEqual(len(fetcher.fetch(self.data_url())), 18)
+
+    def test_backoff_grows_to_limit(self):
+        for attempt in range(10):
+            limit = min(fetcher.BACKOFF_MAX, fetcher.BACKOFF * 2 ** attempt)
+            for _ in range(20):
+                self.assertTrue(0 <= fetcher.backoff(attempt) <= limit)
+
+
+class BreakerTest(StandInTest):
+
+    def test_breaker_pauses_after_failures(self):
+        fetcher.BREAKER = fetcher.CircuitBreaker(threshold=2, cooldown=0.3)
+        self.server.faults = ["503", "503"]
+        started = time.time()
+        self.assertIsNotNone(fetcher.fetch_url(self.data_url()))
+        self.assertGreaterEqual(time.time() - started, 0.3)
+        self.assertEqual(self.counter("breaker_opened"), 1)
+
+    def test_breaker_reopens_if_probe_fails(self):
+        fetcher.BREAKER = fetcher.CircuitBreaker(threshold=2, cooldown=0.2)
+        self.server.faults = ["503", "503", "503"]
+        started = time.time()
+        self.assertIsNotNone(fetcher.fetch_url(self.data_url()))
+        self.assertGreaterEqual(time.time() - started, 0.4)
+        self.assertEqual(self.counter("breaker_opened"), 2)
+
+    def test_success_closes_breaker(self):
+        fetcher.BREAKER = fetcher.CircuitBreaker(threshold=2, cooldown=5)
+        self.server.faults = ["503"]
+        self.assertIsNotNone(fetcher.fetch_url(self.data_url()))
+        self.server.faults = ["503"]
+        started = time.time()
+        self.assertIsNotNone(fetcher.fetch_url(self.data_url()))
+        self.assertLess(time.time() - started, 1)
+        self.assertEqual(self.counter("breaker_opened"), 0)
+
+
+class RedirectTest(StandInTest):
+
+    def test_redirect_is_followed(self):
+        self.server.faults = ["redirect"]
+        self.assertIsNotNone(fetcher.fetch_url(self.data_url()))
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_redirect_to_another_host_is_followed(self):
+        other = StandIn().start()
+        try:
+            self.server.redirect_to = other.url
+            self.server.faults = ["redirect"]
+            self.assertIsNotNone(fetcher.fetch_url(self.data_url()))
+            self.assertEqual(len(other.requests), 1)
+            self.assertEqual(other.requests[0], self.server.requests[0])
+        finally:
+            fetcher.POOL.clear()
+            other.stop()
+
+    def test_redirect_loop_ends(self):
+        self.server.faults = ["redirect"] * (fetcher.MAX_REDIRECTS + 1)
+        status, headers, body = fetcher.POOL.request(self.data_url())
+        self.assertEqual(status, 301)
+        self.assertEqual(len(self.server.requests), fetcher.MAX_REDIRECTS + 1)
+
+
+class ProxyTest(StandInTest):
+
+    def test_http_proxy_is_used(self):
+        os.environ["http_proxy"] = self.server.url
+        url = "http://api.worldbank.invalid/countries/AR/indicators/X"
+        self.assertIsNotNone(fetcher.fetch_url(url))
+        self.assertEqual(self.server.requests, [url])
+
+    def test_proxy_credentials_are_sent(self):
+        os.environ["http_proxy"] = self.server.url.replace(
+            "//", "//user:p%40ss@")
+        fetcher.fetch_url("http://api.worldbank.invalid/countries/AR")
+        self.assertEqual(self.server.headers[0]["proxy-authorization"],
+                         "Basic dXNlcjpwQHNz")
+
+    def test_no_proxy_is_honoured(self):
+        os.environ["http_proxy"] = "http://127.0.0.1:9"
+        os.environ["no_proxy"] = "127.0.0.1"
+        self.assertIsNotNone(fetcher.fetch_url(self.data_url()))
+        self.assertEqual(len(self.server.requests), 1)
+
+
+class RevalidationTest(StandInTest):
+
+    def test_unchanged_page_is_revalidated(self):
+        first = fetcher.fetch(self.data_url())
+        fetcher.EXP = 0
+        self.assertEqual(fetcher.fetch(self.data_url()), first)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertIn("if-none-match", self.server.headers[1])
+        self.assertEqual(self.counter("cache_expired"), 1)
+        self.assertEqual(self.counter("cache_revalidated"), 1)
+
+    def test_changed_page_is_fetched_again(self):
+        fetcher.fetch(self.data_url())
+        fetcher.EXP = 0
+        saved, standin.COUNTRIES = standin.COUNTRIES, ["PE"]
+        try:
+            results = fetcher.fetch(self.data_url())
+        finally:
+            standin.COUNTRIES = saved
+        self.assertEqual(set(i["country"]["id"] for i in results), set(["PE"]))
+        self.assertEqual(self.counter("cache_revalidated"), 0)
+
+    def test_fresh_page_is_not_requested(self):
+        url = self.server.url + "/countries/AR"
+        first = fetcher.fetch(url)
+        self.assertEqual(fetcher.fetch(url), first)
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(self.counter("cache_hits"), 1)
+
+
+class RangeTest(StandInTest):
+
+    def years(self, results):
+        return sorted(set(int(i["date"]) for i in results))
+
+    def test_sub_range_is_answered_from_cache(self):
+        fetcher.fetch(self.data_url())
+        results = fetcher.fetch(self.data_url(), [("date", "2001:2002")])
+        self.assertEqual(self.years(results), [2001, 2002])
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(self.counter("range_hits"), 1)
+
+    @unittest.skipIf(sys.version_info < (3, 7), "needs asyncio.run")
+    def test_async_sub_range_is_answered_from_cache(self):
+        import asyncio
+        from .. import aio
+        fetcher.fetch(self.data_url())
+        results = asyncio.run(aio.fetch_async(self.data_url(),
+                                              [("date", "2001:2002")]))
+        self.assertEqual(self.years(results), [2001, 2002])
+        self.assertEqual(len(self.server.requests), 1)
+
+    @unittest.skipIf(sys.version_info < (3, 7), "needs asyncio.run")
+    def test_async_fetch_covers_its_years(self):
+        import asyncio
+        from .. import aio
+        asyncio.run(aio.fetch_async(self.data_url()))
+        results = fetcher.fetch(self.data_url(), [("date", "2003")])
+        self.assertEqual(self.years(results), [2003])
+        self.assertEqual(len(self.server.requests), 1)
+
+
+class SplitTest(StandInTest):
+
+    def split_url(self, codes):
+        return self.data_url(";".join(codes))
+
+    def codes(self, prefix, count):
+        return ["{0}{1:02d}".format(prefix, i) for i in range(count)]
+
+    def countries(self, results):
+        return set(i["country"]["id"] for i in results)
+
+    def test_parts_are_joined(self):
+        codes = self.codes("C", 60)
+        results = fetcher.fetch(self.split_url(codes))
+        self.assertEqual(self.countries(results), set(codes))
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_failed_part_fails_fetch(self):
+        self.server.broken.add("C55")
+        self.assertIsNone(fetcher.fetch(self.split_url(self.codes("C", 60))))
+
+    def test_empty_part_is_not_a_failure(self):
+        codes = self.codes("C", 50)
+        results = fetcher.fetch(self.split_url(codes + self.codes("X", 10)))
+        self.assertEqual(self.countries(results), set(codes))
+
+    def test_failed_part_fails_stream(self):
+        self.server.broken.add("C55")
+        pages = fetcher.iter_fetch(self.split_url(self.codes("C", 60)))
+        self.assertRaises(ValueError, list, pages)
+
+    def test_empty_stream_ends(self):
+        self.assertEqual(list(fetcher.iter_fetch(self.data_url(
+            indicator="EMPTY"))), [])
+
+    @unittest.skipIf(sys.version_info < (3, 7), "needs asyncio.run")
+    def test_failed_part_fails_async_fetch(self):
+        import asyncio
+        from .. import aio
+        url = self.split_url(self.codes("C", 60))
+        self.server.broken.add("C55")
+        self.assertIsNone(asyncio.run(aio.fetch_async(url)))
+        self.server.broken.clear()
+        self.assertEqual(len(asyncio.run(aio.fetch_async(url))), 360)
+
+    def test_incremental_parts_are_joined(self):
+        codes = self.codes("C", 60)
+        url = self.split_url(codes)
+        results = fetcher.fetch_incremental(url, [("date", "2001:2002")])
+        self.assertEqual(self.countries(results), set(codes))
+        self.assertEqual(len(results), 120)
+        info = fetcher.refresh_info(url)
+        self.assertEqual(info["records"], 360)
+        self.assertEqual(self.counter("series_refreshed"), 2)
+
+    def test_failed_incremental_part_fails_fetch(self):
+        self.server.broken.add("C55")
+        url = self.split_url(self.codes("C", 60))
+        self.assertIsNone(fetcher.fetch_incremental(url))
+        self.assertIsNone(fetcher.refresh_info(url))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+"""
+wbdata.tests.test_import: importing wbdata stays cheap, loading no slow
+modules and touching no files
+"""
+
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+# seconds "import wbdata" may take; it takes about 0.1 s, and pandas alone
+# would take several times that
+IMPORT_BUDGET = 0.5
+
+SLOW_MODULES = ("pandas", "numpy", "asyncio", "multiprocessing")
+
+SCRIPT = """
+import json, sys, time
+started = time.time()
+import wbdata
+seconds = time.time() - started
+print(json.dumps({"seconds": seconds, "modules": sorted(sys.modules)}))
+"""
+
+
+class ImportTest(unittest.TestCase):
+    """Import wbdata in a fresh interpreter with an empty cache directory"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        env = dict(os.environ, XDG_CACHE_HOME=self.tmpdir, HOME=self.tmpdir,
+                   LOCALAPPDATA=self.tmpdir)
+        package_dir = os.path.dirname(os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__))))
+        env["PYTHONPATH"] = os.pathsep.join(
+            [package_dir] + [i for i in [env.get("PYTHONPATH")] if i])
+        output = subprocess.check_output([sys.executable, "-c", SCRIPT],
+                                         env=env, cwd=self.tmpdir)
+        self.result = json.loads(output.decode("utf-8").splitlines()[-1])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_slow_modules_are_not_imported(self):
+        imported = set(name.split(".")[0] for name in self.result["modules"])
+        for name in SLOW_MODULES:
+            self.assertNotIn(name, imported)
+
+    def test_no_cache_is_created(self):
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_import_is_within_budget(self):
+        self.assertLess(self.result["seconds"], IMPORT_BUDGET)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+"""
+wbdata.tests.test_prefetch: planning the queries of a prefetch manifest
+"""
+
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+import unittest
+
+from .. import prefetch
+
+
+class PlanTest(unittest.TestCase):
+
+    def dates(self, manifest):
+        manifest = dict(manifest, indicators=["SP.POP.TOTL"])
+        return [dict(args).get("date") for query_url, args in
+                prefetch.plan(manifest)]
+
+    def test_years_are_fetched_as_one_span(self):
+        self.assertEqual(self.dates({"years": [1960, 2014]}), ["1960:2014"])
+
+    def test_adjoining_and_overlapping_dates_are_merged(self):
+        self.assertEqual(self.dates({"dates": [2000, [2005, 2007], 2003,
+                                               2004, 2010]}),
+                         ["2000", "2003:2007", "2010"])
+
+    def test_all_years_cover_every_date(self):
+        self.assertEqual(self.dates({"dates": [2000, None],
+                                     "years": [1990, 1995]}), [None])
+
+
+if __name__ == "__main__":
+    unittest.main()
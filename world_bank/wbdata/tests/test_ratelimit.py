@@ -0,0 +1,91 @@
+"""
+wbdata.tests.test_ratelimit: the pace token buckets hold requests to
+"""
+
+from __future__ import (print_function, division, absolute_import,
+                        unicode_literals)
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from ..ratelimit import SharedTokenBucket, TokenBucket
+
+RATE = 50
+BURST = 5
+
+
+class BucketTest(unittest.TestCase):
+
+    def elapsed(self, acquires):
+        """Return the seconds it takes to call each of acquires in turn"""
+        started = time.time()
+        for acquire in acquires:
+            acquire()
+        return time.time() - started
+
+    def assertPaced(self, seconds, expected):
+        self.assertGreaterEqual(seconds, expected * 0.9)
+        self.assertLess(seconds, expected + 0.15)
+
+
+class TokenBucketTest(BucketTest):
+
+    def test_burst_is_not_delayed(self):
+        bucket = TokenBucket(RATE, BURST)
+        self.assertLess(self.elapsed([bucket.acquire] * BURST), 0.05)
+
+    def test_rate_is_kept_after_burst(self):
+        bucket = TokenBucket(RATE, BURST)
+        # the burst is free, and the other ten take a fiftieth of a second
+        # each
+        self.assertPaced(self.elapsed([bucket.acquire] * 15), 0.2)
+
+    def test_threads_share_the_bucket(self):
+        bucket = TokenBucket(RATE, BURST)
+        threads = [threading.Thread(target=self.elapsed,
+                                    args=([bucket.acquire] * 5,))
+                   for _ in range(4)]
+        started = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertPaced(time.time() - started, 0.3)
+
+    def test_rate_must_be_positive(self):
+        self.assertRaises(ValueError, TokenBucket, 0)
+
+
+class SharedTokenBucketTest(BucketTest):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "ratelimit.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_rate_is_kept_after_burst(self):
+        bucket = SharedTokenBucket(RATE, BURST, self.path)
+        self.assertPaced(self.elapsed([bucket.acquire] * 15), 0.2)
+
+    def test_buckets_on_one_file_share_the_budget(self):
+        first = SharedTokenBucket(RATE, BURST, self.path)
+        second = SharedTokenBucket(RATE, BURST, self.path)
+        self.assertPaced(self.elapsed([first.acquire, second.acquire] * 7 +
+                                      [first.acquire]), 0.2)
+
+    def test_buckets_on_other_files_do_not(self):
+        first = SharedTokenBucket(RATE, BURST, self.path)
+        second = SharedTokenBucket(RATE, BURST,
+                                   os.path.join(self.tmpdir, "other.sqlite"))
+        self.assertLess(self.elapsed([first.acquire, second.acquire] *
+                                     BURST), 0.1)
+
+
+if __name__ == "__main__":
+    unittest.main()